@@ -22,6 +22,34 @@ import re
 import argparse
 import unicodedata
 import queue
+import functools
+import array
+import mmap
+import tempfile
+import collections
+import marshal
+import zlib
+import select
+import selectors
+import asyncio
+import codecs
+import bisect
+import concurrent.futures
+import signal
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
+    termios = None
+try:
+    import resource
+except ImportError:
+    resource = None
 try:
     import pyperclip
 except Exception:
@@ -40,13 +68,81 @@ variables = {}
 variable_pattern = re.compile(r'\{([A-Za-z0-9_-]+)\}')
 CLI_MODE = False
 MAX_BUFFER_LINES = 20000
+SCROLLBACK_MODE = 'memory'
+SCROLLBACK_SPILL_DIR = None
+SCROLLBACK_HOT_LINES = 2048
+SCROLLBACK_BLOCK_LINES = 512
+SCROLLBACK_BLOCK_CACHE = 4
+SCROLLBACK_CODEC = 'zlib'
 COMPLETION_DEBOUNCE_MS = 100
 COMPLETION_MIN_PREFIX = 0
 COMPLETION_MAX_RESULTS = 200
+COMPLETION_BUDGET_MS = 10
+_COMPLETER = None
+_COMPLETER_LOCK = threading.Lock()
+DIR_CACHE_ENTRIES = 32
+_DIR_CACHE = collections.OrderedDict()
+_DIR_CACHE_LOCK = threading.Lock()
+BUILTIN_COMMANDS = (
+    "tab", "run", "cd", "cwd", "files", "makedir", "deldir", "remove", "echo", "make", "download", "alias", "tree",
+    "history", "color", "clear", "read", "move", "copy", "kill", "variable", "shutdown", "restart", "last", "env",
+    "setenv", "unsetenv", "render", "engine", "jobs", "wait", "parallel", "output", "time", "stats",
+    "completion"
+)
 _completion_cache_key = None
 _completion_cache_time = 0.0
 _completion_cache_results = []
 TABS_LOCK = threading.RLock()
+_WIDTH_PAGES = {}
+_FULL_REDRAW = threading.Event()
+COALESCE_INTERVAL_MS = 10
+COALESCE_MAX_LINES = 512
+_COALESCERS = set()
+_COALESCERS_LOCK = threading.Lock()
+_coalesce_flusher = None
+OUTPUT_POLICY = 'block'
+OUTPUT_QUEUE_LINES = 20000
+OUTPUT_DRAIN_LINES = 4096
+OUTPUT_SAMPLE_EVERY = 100
+_OUTPUT_STATS_LOCK = threading.Lock()
+PIPE_BUFFER_LINES = 4096
+PIPE_BATCH_LINES = 256
+_PIPE_NOWAIT = threading.local()
+WRAP_FILL_CHUNK = 256
+WRAP_ROWS_CACHE_LINES = 1024
+_WRAP_FILL_TABS = set()
+_WRAP_FILL_LOCK = threading.Lock()
+_WRAP_FILL_EVENT = threading.Event()
+_wrap_filler = None
+INPUT_POLL_MS = 50
+_UI_WAKER = None
+_RESIZE_PENDING = threading.Event()
+RENDER_MAX_FPS = 60
+RENDER_MIN_FRAME_MS = 0
+_RENDER_SCHEDULER = None
+IO_READ_CHUNK = 65536
+IO_READ_CHUNK_MAX = 256 * 1024
+IO_PIPE_SIZE = 256 * 1024
+IO_REAP_INTERVAL_MS = 200
+_IO_HUB = None
+_IO_HUB_LOCK = threading.Lock()
+EXEC_ENGINE = 'threads'
+_ASYNC_ENGINE = None
+_ASYNC_ENGINE_LOCK = threading.Lock()
+DOWNLOAD_MAX_BYTES = 50 * 1024 * 1024
+DOWNLOAD_TOTAL_TIMEOUT = 60
+DOWNLOAD_CONNECT_TIMEOUT = 15
+DOWNLOAD_CHUNK = 64 * 1024
+JOB_WORKERS = 16
+JOB_HISTORY = 20
+_JOB_EXECUTOR = None
+_JOB_EXECUTOR_LOCK = threading.Lock()
+_BACKGROUND_SLOTS = set()
+_CURRENT_JOB = threading.local()
+PATH_RECHECK_MS = 1000
+_ENV_SNAPSHOT = None
+STATS_FOOTER = False
+_ACCOUNTING = threading.local()
 
 
 
@@ -71,49 +167,153 @@ def _invalidate_completion_cache():
 
 
 
+class _CommandIndex:
+    def __init__(self, names=()):
+        self.names = []
+        self.rank = {}
+        self.version = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        with self._lock:
+            if name in self.rank:
+                return
+            self.rank[name] = self._next
+            self._next += 1
+            bisect.insort(self.names, name)
+            self.version += 1
+
+    def complete(self, prefix):
+        with self._lock:
+            lo = bisect.bisect_left(self.names, prefix)
+            hi = bisect.bisect_left(self.names, prefix + "\U0010ffff", lo)
+            matches = self.names[lo:hi]
+            matches.sort(key=self.rank.__getitem__)
+        return matches
+
+
+
+_COMMAND_INDEX = _CommandIndex(BUILTIN_COMMANDS)
+
+
+
+def _dir_listing(path):
+    mtime = os.stat(path).st_mtime_ns
+    with _DIR_CACHE_LOCK:
+        entry = _DIR_CACHE.get(path)
+        if entry is not None and entry[0] == mtime:
+            _DIR_CACHE.move_to_end(path)
+            return entry
+    names = []
+    dirs = set()
+    with os.scandir(path) as it:
+        for e in it:
+            names.append(e.name)
+            try:
+                if e.is_dir():
+                    dirs.add(e.name)
+            except OSError:
+                pass
+    names.sort()
+    entry = (mtime, names, dirs)
+    with _DIR_CACHE_LOCK:
+        _DIR_CACHE[path] = entry
+        _DIR_CACHE.move_to_end(path)
+        while len(_DIR_CACHE) > DIR_CACHE_ENTRIES:
+            _DIR_CACHE.popitem(last=False)
+    return entry
+
+
+
+def _dir_matches(path, prefix, limit=None):
+    _, names, dirs = _dir_listing(path)
+    lo = bisect.bisect_left(names, prefix)
+    hi = bisect.bisect_left(names, prefix + "\U0010ffff", lo)
+    if limit is not None:
+        hi = min(hi, lo + limit)
+    return [(name, name in dirs) for name in names[lo:hi]]
+
+
+
+def _width_page(page: int) -> bytes:
+    table = _WIDTH_PAGES.get(page)
+    if table is None:
+        base = page << 8
+        widths = bytearray(256)
+        for i in range(256):
+            try:
+                ch = chr(base + i)
+                if unicodedata.combining(ch):
+                    widths[i] = 0
+                else:
+                    widths[i] = 2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1
+            except Exception:
+                widths[i] = 1
+        table = bytes(widths)
+        _WIDTH_PAGES[page] = table
+    return table
+
+
+
 def _char_display_width(ch: str) -> int:
     try:
         if not ch:
             return 0
-        if unicodedata.combining(ch):
-            return 0
-        eaw = unicodedata.east_asian_width(ch)
-        return 2 if eaw in ("W", "F") else 1
+        if ch.isascii():
+            return 1
+        cp = ord(ch)
+        return _width_page(cp >> 8)[cp & 0xFF]
     except Exception:
         return 1
 
 
 
+@functools.lru_cache(maxsize=4096)
+def _line_widths(s: str) -> bytes:
+    return bytes(_char_display_width(ch) for ch in s)
+
+
+
 def _display_width(s: str) -> int:
-    return sum(_char_display_width(ch) for ch in s)
+    if s.isascii():
+        return len(s)
+    return sum(_line_widths(s))
 
 
 
 def _slice_by_display_cols(s: str, start_col: int, max_cols: int):
     if start_col < 0:
         start_col = 0
-    used = 0
+    if s.isascii():
+        n = len(s)
+        if start_col >= n:
+            return "", n, n, 0
+        end = min(n, start_col + max(max_cols, 0))
+        return s[start_col:end], start_col, end, end - start_col
+    widths = _line_widths(s)
+    n = len(s)
     cur_col = 0
-    start_idx = 0
-    for i, ch in enumerate(s):
-        w = _char_display_width(ch)
+    start_idx = n
+    for i in range(n):
+        w = widths[i]
         if cur_col + w > start_col:
             start_idx = i
             break
         cur_col += w
     else:
-        return "", len(s), len(s), 0
-    parts = []
-    for j in range(start_idx, len(s)):
-        ch = s[j]
-        w = _char_display_width(ch)
+        return "", n, n, 0
+    used = 0
+    end_idx = n
+    for j in range(start_idx, n):
+        w = widths[j]
         if used + w > max_cols:
             end_idx = j
-            return ("".join(parts), start_idx, end_idx, used)
-        parts.append(ch)
+            break
         used += w
-    end_idx = len(s)
-    return ("".join(parts), start_idx, end_idx, used)
+    return (s[start_idx:end_idx], start_idx, end_idx, used)
 
 
 
@@ -148,27 +348,182 @@ def _wrap_display_line(s: str, width: int):
         return [s] if s != "" else [""]
     if s == "":
         return [""]
+    if s.isascii():
+        return [s[i:i + width] for i in range(0, len(s), width)]
+    widths = _line_widths(s)
+    if not any(widths):
+        return [""]
     out = []
-    start_col = 0
-    total_cols = _display_width(s)
-    if width <= 0:
-        return [s]
-    while start_col < total_cols:
-        seg, _, _, used = _slice_by_display_cols(s, start_col, width)
-        out.append(seg)
+    n = len(s)
+    i = 0
+    while widths[i] == 0:
+        i += 1
+    while i < n:
+        used = 0
+        j = i
+        while j < n and used + widths[j] <= width:
+            used += widths[j]
+            j += 1
+        out.append(s[i:j])
         if used <= 0:
             break
-        start_col += used
-    return out if out else [""]
+        i = j
+    return out
 
 
 
 def _sanitized_env():
-    env = os.environ.copy()
-    for k in list(env.keys()):
-        if k.startswith(("LD_", "DYLD_")) or k in {"PYTHONPATH", "PYTHONHOME", "PYTHONSTARTUP", "PYTHONWARNINGS"}:
-            env.pop(k, None)
-    return env
+    global _ENV_SNAPSHOT
+    snapshot = _ENV_SNAPSHOT
+    if snapshot is None:
+        env = os.environ.copy()
+        for k in list(env.keys()):
+            if k.startswith(("LD_", "DYLD_")) or k in {"PYTHONPATH", "PYTHONHOME", "PYTHONSTARTUP", "PYTHONWARNINGS"}:
+                env.pop(k, None)
+        _ENV_SNAPSHOT = snapshot = env
+    return dict(snapshot)
+
+
+
+def _invalidate_env():
+    global _ENV_SNAPSHOT
+    _ENV_SNAPSHOT = None
+
+
+
+def _sanitize_download_name(name: str) -> str:
+    try:
+        name = ''.join(ch for ch in name if unicodedata.category(ch) != 'Cc')
+    except Exception:
+        pass
+    try:
+        name = os.path.normpath(name)
+    except Exception:
+        pass
+    try:
+        name = os.path.basename(name)
+    except Exception:
+        pass
+    for sep in (os.sep, os.altsep):
+        if sep:
+            name = name.replace(sep, '_')
+    name = name.strip().strip('.')
+    if not name or name in ('.', '..'):
+        name = 'download'
+    return name
+
+
+
+def _path_stamp():
+    path = os.environ.get("PATH", os.defpath)
+    mtimes = []
+    for d in path.split(os.pathsep):
+        try:
+            mtimes.append(os.stat(d or os.curdir).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return path, os.environ.get("PATHEXT", ""), tuple(mtimes)
+
+
+
+class _PathIndex:
+    def __init__(self):
+        self.stamp = None
+        self.paths = {}
+        self.names = []
+        self._checked = 0.0
+        self._building = False
+        self._lock = threading.Lock()
+
+    def _key(self, name):
+        return name.lower() if os.name == 'nt' else name
+
+    def _current(self):
+        stamp = self.stamp
+        if stamp is None or stamp[0] != os.environ.get("PATH", os.defpath):
+            return False
+        return os.name != 'nt' or stamp[1] == os.environ.get("PATHEXT", "")
+
+    def refresh(self):
+        now = time.monotonic()
+        current = self._current()
+        if current and now - self._checked < PATH_RECHECK_MS / 1000.0:
+            return True
+        with self._lock:
+            if self._building:
+                return current
+            self._building = True
+            self._checked = now
+        try:
+            threading.Thread(target=self._build, daemon=True).start()
+        except RuntimeError:
+            with self._lock:
+                self._building = False
+        return current
+
+    def _build(self):
+        try:
+            stamp = _path_stamp()
+            if stamp == self.stamp:
+                return
+            exts = [e.lower() for e in stamp[1].split(os.pathsep) if e] if os.name == 'nt' else []
+            paths = {}
+            for d in stamp[0].split(os.pathsep):
+                if not d or not os.path.isabs(d):
+                    continue
+                try:
+                    with os.scandir(d) as it:
+                        entries = list(it)
+                except OSError:
+                    continue
+                for e in entries:
+                    try:
+                        if not e.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    keys = [self._key(e.name)]
+                    if os.name == 'nt':
+                        root, ext = os.path.splitext(keys[0])
+                        if ext not in exts:
+                            continue
+                        keys.append(root)
+                    elif not os.access(e.path, os.X_OK):
+                        continue
+                    for k in keys:
+                        if k not in paths:
+                            paths[k] = e.path
+            if os.name == 'nt':
+                names = sorted(k for k in paths if os.path.splitext(k)[1] not in exts)
+            else:
+                names = sorted(paths)
+            with self._lock:
+                self.stamp = stamp
+                self.paths = paths
+                self.names = names
+        finally:
+            with self._lock:
+                self._building = False
+
+    def lookup(self, name):
+        if not self.refresh():
+            return None
+        return self.paths.get(self._key(name))
+
+    def complete(self, prefix, limit=None):
+        if not self.refresh():
+            return []
+        names = self.names
+        prefix = self._key(prefix)
+        lo = bisect.bisect_left(names, prefix)
+        hi = bisect.bisect_left(names, prefix + "\U0010ffff", lo)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return names[lo:hi]
+
+
+
+_PATH_INDEX = _PathIndex()
 
 
 
@@ -176,8 +531,13 @@ def _resolve_cmd_path(cmd):
     try:
         if os.path.isabs(cmd) and os.path.exists(cmd):
             return cmd
-        resolved = shutil.which(cmd)
-        return resolved or cmd
+        if os.sep in cmd or (os.altsep and os.altsep in cmd):
+            return shutil.which(cmd) or cmd
+        if os.name == 'nt' and "NoDefaultCurrentDirectoryInExePath" not in os.environ:
+            local = shutil.which(cmd, path=os.curdir)
+            if local:
+                return local
+        return _PATH_INDEX.lookup(cmd) or shutil.which(cmd) or cmd
     except Exception:
         return cmd
 
@@ -228,7 +588,7 @@ def expand_variables(text, tab):
 
 def define_alias(original, alias):
     ALIASES[original.lower()] = alias
-    _invalidate_completion_cache()
+    _COMMAND_INDEX.add(original.lower())
 
 
 
@@ -236,7 +596,7 @@ def define_command(name, function, arguments):
     key = name.lower()
     CUSTOM_COMMANDS[key] = function
     CUSTOM_COMMANDS[f"__{key}_args"] = arguments
-    _invalidate_completion_cache()
+    _COMMAND_INDEX.add(key)
 
 
 
@@ -252,9 +612,10 @@ def api_run_command(cmd_line):
             if not isinstance(s, str):
                 s = str(s)
             self._buf += s
-            while "\n" in self._buf:
-                line, self._buf = self._buf.split("\n", 1)
-                self.tab.add(line)
+            if "\n" in self._buf:
+                lines = self._buf.split("\n")
+                self._buf = lines.pop()
+                self.tab.add_many(lines)
         def flush(self):
             if self._buf:
                 self.tab.add(self._buf)
@@ -365,184 +726,2389 @@ def ensure_plugins_loaded(tab=None):
 
 
 
-class Tab:
-    def __init__(self, name="New Tab", load_plugins_on_init=True):
-        self.name = name
-        self.mode = 'poly'
-        self.cwd = os.getcwd()
-        self.buffer = []
-        self.history = []
-        self.scroll = 0
-        self.color_settings = {}
-        self._next_color_pair = 3
-        self.lock = threading.Lock()
-        self.shell_proc = None
-        self.readers = []
-        self.workers = []
-        self.stdin_lock = threading.Lock()
-        self.wrap_cache_width = None
-        self.wrap_cache_lines = []
-        self.wrap_cache_counts = []
-        self.plugins = ensure_plugins_loaded(self) if load_plugins_on_init else list(_LOADED_PLUGINS)
-        self.current_proc = None
-        self.current_proc_lock = threading.Lock()
-        self.pending_last_picker = False
-        self._cancel_event = threading.Event()
+class _UiWaker:
+    def __init__(self):
+        self._event = threading.Event()
+        self.signals = 0
+        self._rfd = None
+        self._wfd = None
+        if os.name != 'nt':
+            try:
+                self._rfd, self._wfd = os.pipe()
+                os.set_blocking(self._rfd, False)
+                os.set_blocking(self._wfd, False)
+            except OSError:
+                self._rfd = self._wfd = None
+
+    def signal(self):
+        self.signals += 1
+        if self._event.is_set():
+            return
+        self._event.set()
+        wfd = self._wfd
+        if wfd is not None:
+            try:
+                os.write(wfd, b"\0")
+            except OSError:
+                pass
+
+    def take_signals(self):
+        n = self.signals
+        self.signals = 0
+        return n
+
+    def wait(self, fd, timeout):
+        input_ready = False
+        if not self._event.is_set():
+            if self._rfd is None or fd is None:
+                self._event.wait(min(timeout, INPUT_POLL_MS / 1000.0))
+            else:
+                try:
+                    ready, _, _ = select.select([fd, self._rfd], [], [], timeout)
+                    input_ready = fd in ready
+                except (OSError, ValueError):
+                    self._event.wait(min(timeout, INPUT_POLL_MS / 1000.0))
+        self._event.clear()
+        if self._rfd is not None:
+            try:
+                while os.read(self._rfd, 4096):
+                    pass
+            except OSError:
+                pass
+        return input_ready
+
+    def wait_input(self, fd, timeout):
+        if self._rfd is None or fd is None:
+            time.sleep(min(timeout, INPUT_POLL_MS / 1000.0))
+            return False
+        try:
+            ready, _, _ = select.select([fd], [], [], timeout)
+        except (OSError, ValueError):
+            return False
+        return bool(ready)
+
+    def close(self):
+        fds = (self._rfd, self._wfd)
+        self._rfd = self._wfd = None
+        for fd in fds:
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+
+
+class _RenderScheduler:
+    def __init__(self):
+        self.frames = 0
+        self.coalesced = 0
+        self.deferred = 0
+        self._last = 0.0
+
+    def interval(self):
+        fps = RENDER_MAX_FPS
+        step = (1.0 / fps) if fps > 0 else 0.0
+        return max(step, RENDER_MIN_FRAME_MS / 1000.0)
+
+    def frame(self, updates, drawn):
+        if not drawn:
+            return
+        self.frames += 1
+        if updates > 1:
+            self.coalesced += updates - 1
+        self._last = time.monotonic()
+
+    def throttle(self, waker, fd):
+        delay = self._last + self.interval() - time.monotonic()
+        if delay <= 0:
+            return
+        self.deferred += 1
+        waker.wait_input(fd, delay)
+
+
+
+def _wake_ui():
+    waker = _UI_WAKER
+    if waker is not None:
+        waker.signal()
+
+
+
+def _close_ui_waker():
+    global _UI_WAKER
+    waker, _UI_WAKER = _UI_WAKER, None
+    if waker is not None:
+        waker.close()
+
+
+
+def _on_sigwinch(signum, frame):
+    _RESIZE_PENDING.set()
+    _wake_ui()
+
+
+
+def _apply_resize():
+    if not _RESIZE_PENDING.is_set():
+        return False
+    _RESIZE_PENDING.clear()
+    fd = _stdin_fd()
+    try:
+        size = os.get_terminal_size(fd if fd is not None else 0)
+        curses.resizeterm(size.lines, size.columns)
+    except (OSError, ValueError, curses.error):
+        pass
+    return True
+
+
+
+def _stdin_fd():
+    try:
+        return sys.stdin.fileno()
+    except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+        return None
+
+
+
+class _RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = max(int(capacity), 1)
+        self._items = [None] * self.capacity
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        end = self._start + self._len
+        if end <= self.capacity:
+            return iter(self._items[self._start:end])
+        return iter(self._items[self._start:] + self._items[:end - self.capacity])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if index < 0 or index >= self._len:
+            raise IndexError("ring buffer index out of range")
+        return self._items[(self._start + index) % self.capacity]
+
+    def append(self, item):
+        if self._len < self.capacity:
+            self._items[(self._start + self._len) % self.capacity] = item
+            self._len += 1
+            return None
+        evicted = self._items[self._start]
+        self._items[self._start] = item
+        self._start = (self._start + 1) % self.capacity
+        return evicted
 
-    def add(self, text):
-        with self.lock:
-            new_lines = text.split('\n')
-            for line in new_lines:
-                self.buffer.append(line)
-                if self.wrap_cache_width is not None:
-                    wrapped = _wrap_display_line(line, self.wrap_cache_width)
-                    if not wrapped:
-                        wrapped = [""]
-                    self.wrap_cache_lines.extend(wrapped)
-                    self.wrap_cache_counts.append(len(wrapped))
-                if CLI_MODE:
-                    print(line, flush=True)
-            excess = len(self.buffer) - MAX_BUFFER_LINES
-            if excess > 0:
-                self.buffer = self.buffer[excess:]
-                if self.wrap_cache_width is not None and self.wrap_cache_counts:
-                    drop_wrapped = sum(self.wrap_cache_counts[:excess])
-                    self.wrap_cache_counts = self.wrap_cache_counts[excess:]
-                    self.wrap_cache_lines = self.wrap_cache_lines[drop_wrapped:]
-                    self.scroll = max(0, self.scroll - drop_wrapped)
-    
     def clear(self):
-        with self.lock:
-            self.buffer = []
-            self.wrap_cache_lines = []
-            self.wrap_cache_counts = []
-            self.wrap_cache_width = None
-            self.scroll = 0
+        self._items = [None] * self.capacity
+        self._start = 0
+        self._len = 0
+
+
+
+class _DiskSpill:
+    def __init__(self, directory=None):
+        self._file = tempfile.TemporaryFile(prefix="poly-scrollback-", dir=directory)
+        self._offsets = array.array('Q', [0])
+        self._map = None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        return self.iter_range(0, len(self))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("spill index out of range")
+        start, end = self._offsets[index], self._offsets[index + 1]
+        if start == end:
+            return ""
+        return self._view(end)[start:end].decode('utf-8', errors='replace')
+
+    def _view(self, end):
+        if self._map is None or len(self._map) < end:
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def iter_range(self, start, stop):
+        stop = min(stop, len(self))
+        if start >= stop:
+            return
+        offsets = self._offsets
+        view = self._view(offsets[stop]) if offsets[stop] > offsets[start] else None
+        for i in range(start, stop):
+            a, b = offsets[i], offsets[i + 1]
+            yield view[a:b].decode('utf-8', errors='replace') if b > a else ""
 
-    def _ensure_wrap_cache(self, width):
-        if width != self.wrap_cache_width:
-            self.wrap_cache_lines = []
-            self.wrap_cache_counts = []
-            for line in self.buffer:
-                wrapped = _wrap_display_line(line, width)
-                if not wrapped:
-                    wrapped = [""]
-                self.wrap_cache_lines.extend(wrapped)
-                self.wrap_cache_counts.append(len(wrapped))
-            self.wrap_cache_width = width
+    def append(self, line):
+        data = line.encode('utf-8', errors='replace')
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
 
-    def request_cancel(self):
-        self._cancel_event.set()
+    def clear(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.seek(0)
+        self._file.truncate()
+        self._offsets = array.array('Q', [0])
+
+    def close(self):
+        try:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+        finally:
+            self._file.close()
+
+
+
+class _BlockStore:
+    def __init__(self, block_lines=None, codec=None):
+        self.block_lines = max(int(block_lines or SCROLLBACK_BLOCK_LINES), 1)
+        self.codec = codec or SCROLLBACK_CODEC
+        if self.codec == 'lzma' and lzma is None:
+            self.codec = 'zlib'
+        self._blocks = collections.deque()
+        self._first_serial = 0
+        self._head = 0
+        self._tail = []
+        self._cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._blocks) * self.block_lines - self._head + len(self._tail)
+
+    def __iter__(self):
+        return self.iter_range(0, len(self))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("block store index out of range")
+        pos = self._head + index
+        bi = pos // self.block_lines
+        if bi < len(self._blocks):
+            return self._block(bi)[pos % self.block_lines]
+        return self._tail[pos - len(self._blocks) * self.block_lines]
+
+    def _compress(self, lines):
+        data = marshal.dumps(tuple(lines))
+        if self.codec == 'lzma':
+            return lzma.compress(data, preset=1)
+        return zlib.compress(data, 6)
+
+    def _decompress(self, blob):
+        if self.codec == 'lzma':
+            return marshal.loads(lzma.decompress(blob))
+        return marshal.loads(zlib.decompress(blob))
+
+    def _block(self, bi):
+        serial = self._first_serial + bi
+        lines = self._cache.get(serial)
+        if lines is not None:
+            self._cache.move_to_end(serial)
+            return lines
+        lines = self._decompress(self._blocks[bi])
+        self._cache[serial] = lines
+        while len(self._cache) > SCROLLBACK_BLOCK_CACHE:
+            self._cache.popitem(last=False)
+        return lines
+
+    def iter_range(self, start, stop):
+        stop = min(stop, len(self))
+        pos = self._head + max(start, 0)
+        end = self._head + stop
+        sealed = len(self._blocks) * self.block_lines
+        while pos < end and pos < sealed:
+            bi, off = divmod(pos, self.block_lines)
+            lines = self._block(bi)
+            take = min(self.block_lines - off, end - pos)
+            yield from lines[off:off + take]
+            pos += take
+        if pos < end:
+            yield from self._tail[pos - sealed:end - sealed]
+
+    def append(self, line):
+        self._tail.append(line)
+        if len(self._tail) >= self.block_lines:
+            self._blocks.append(self._compress(self._tail))
+            self._tail = []
+
+    def drop_front(self):
+        if self._blocks:
+            self._head += 1
+            if self._head >= self.block_lines:
+                self._blocks.popleft()
+                self._cache.pop(self._first_serial, None)
+                self._first_serial += 1
+                self._head = 0
+        elif self._tail:
+            del self._tail[0]
 
-    def clear_cancel(self):
-        self._cancel_event.clear()
+    def clear(self):
+        self._blocks.clear()
+        self._cache.clear()
+        self._first_serial = 0
+        self._head = 0
+        self._tail = []
+
+    def close(self):
+        self.clear()
+
+
+
+class _Scrollback:
+    def __init__(self, hot_capacity, limit=None, cold=None):
+        self.limit = limit
+        self.hot = _RingBuffer(min(hot_capacity, limit) if limit else hot_capacity)
+        self.cold = cold if cold is not None else _BlockStore()
+
+    def __len__(self):
+        return len(self.cold) + len(self.hot)
+
+    def __iter__(self):
+        yield from self.cold
+        yield from self.hot
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        cold = len(self.cold)
+        if 0 <= index < cold:
+            return self.cold[index]
+        return self.hot[index - cold]
+
+    def iter_range(self, start, stop):
+        cold = len(self.cold)
+        if start < cold:
+            yield from self.cold.iter_range(start, min(stop, cold))
+        if stop > cold:
+            yield from self.hot[max(start - cold, 0):stop - cold]
+
+    def append(self, line):
+        evicted = self.hot.append(line)
+        if evicted is None:
+            return 0
+        self.cold.append(evicted)
+        if self.limit is not None and len(self) > self.limit:
+            self.cold.drop_front()
+            return 1
+        return 0
+
+    def replace_cold(self, cold, limit):
+        old, self.cold = self.cold, cold
+        self.limit = limit
+        try:
+            old.close()
+        except Exception:
+            pass
 
-    def is_cancelled(self) -> bool:
-        return self._cancel_event.is_set()
+    def clear(self):
+        self.hot.clear()
+        self.cold.clear()
+
+
+
+class _Fenwick:
+    def __init__(self, values=(), typecode='Q'):
+        tree = array.array(typecode, [0])
+        tree.extend(values)
+        n = len(tree) - 1
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self._tree = tree
+
+    @classmethod
+    def of_ones(cls, count, typecode='Q'):
+        fw = cls(typecode=typecode)
+        fw._tree = array.array(typecode, (i & -i for i in range(count + 1)))
+        return fw
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def append(self, value):
+        tree = self._tree
+        i = len(tree)
+        stop = i - (i & -i)
+        j = i - 1
+        while j > stop:
+            value += tree[j]
+            j -= j & -j
+        tree.append(value)
+
+    def add(self, index, delta):
+        tree = self._tree
+        n = len(tree)
+        i = index + 1
+        while i < n:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, count):
+        tree = self._tree
+        total = 0
+        i = count
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def search(self, target):
+        tree = self._tree
+        n = len(tree) - 1
+        pos = 0
+        step = 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return pos
+
+
+
+class _WrapIndex:
+    def __init__(self, width, count=0):
+        self.width = width
+        self.counts = array.array('I', bytes(4 * count))
+        self.tree = _Fenwick.of_ones(count)
+        self.pending = _Fenwick.of_ones(count, 'I')
+        self.head = 0
+        self.base = 0
+        self.total = count
+        self.unknown = count
+        self.fill_pos = 0
+        self.rows_cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.counts) - self.head
+
+    def append(self):
+        self.counts.append(0)
+        self.tree.append(1)
+        self.pending.append(1)
+        self.total += 1
+        self.unknown += 1
+
+    def drop_front(self):
+        k = self.head
+        rows = self.counts[k]
+        if not rows:
+            rows = 1
+            self.unknown -= 1
+            self.pending.add(k, -1)
+        self.tree.add(k, -rows)
+        self.total -= rows
+        self.rows_cache.pop(self.base + k, None)
+        self.head = k + 1
+        if self.head > 4096 and self.head * 2 > len(self.counts):
+            self._compact()
+        return rows
+
+    def _compact(self):
+        head = self.head
+        self.counts = self.counts[head:]
+        self.tree = _Fenwick(c or 1 for c in self.counts)
+        self.pending = _Fenwick((0 if c else 1 for c in self.counts), 'I')
+        self.base += head
+        self.fill_pos = max(self.fill_pos - head, 0)
+        self.head = 0
+
+    def set_count(self, index, rows):
+        k = self.head + index
+        old = self.counts[k]
+        if old == rows:
+            return
+        if not old:
+            old = 1
+            self.unknown -= 1
+            self.pending.add(k, -1)
+        self.counts[k] = rows
+        if rows != old:
+            self.tree.add(k, rows - old)
+            self.total += rows - old
+
+    def rows_for(self, index, line):
+        key = self.base + self.head + index
+        rows = self.rows_cache.get(key)
+        if rows is not None:
+            self.rows_cache.move_to_end(key)
+            return rows
+        rows = _wrap_display_line(line, self.width) or [""]
+        self.set_count(index, len(rows))
+        self.rows_cache[key] = rows
+        if len(self.rows_cache) > WRAP_ROWS_CACHE_LINES:
+            self.rows_cache.popitem(last=False)
+        return rows
+
+    def resolve_tail(self, rows, line_at):
+        while self.unknown:
+            target = max(self.total - rows, 0)
+            k = max(self.tree.search(target), self.head)
+            before = self.pending.prefix(k)
+            if before >= self.unknown:
+                return
+            i = self.pending.search(before) - self.head
+            self.rows_for(i, line_at(i))
 
-    def get_wrapped_lines(self, width):
-        with self.lock:
-            self._ensure_wrap_cache(width)
-            return list(self.wrap_cache_lines)
+    def locate(self, row):
+        k = self.tree.search(row)
+        return k - self.head, row - self.tree.prefix(k)
 
-    def run_exec(self, program, sink=None, synchronous=None, stdin_text=None, soft_timeout_seconds=5.0):
-        
-        def _worker(cmd, cwd):
-            self.clear_cancel()
+
+
+def _wrap_fill_loop():
+    while not GLOBAL_SHUTDOWN.is_set():
+        with _WRAP_FILL_LOCK:
+            pending = list(_WRAP_FILL_TABS)
+            _WRAP_FILL_TABS.clear()
+        if not pending:
+            _WRAP_FILL_EVENT.wait(0.5)
+            _WRAP_FILL_EVENT.clear()
+            continue
+        for tab in pending:
             try:
-                use_shell = False
-                stripped = cmd.lstrip()
-                if stripped.startswith("!"):
-                    use_shell = True
-                    cmd_to_run = stripped[1:].lstrip()
-                else:
-                    argv = shlex.split(cmd, posix=(os.name != 'nt'))
-                    if not argv:
-                        self.add("run: no command provided")
-                        return
-                    argv[0] = _resolve_cmd_path(argv[0])
-                    cmd_to_run = argv
-
-                proc = subprocess.Popen(
-                    cmd_to_run,
-                    shell=use_shell,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    stdin=subprocess.PIPE if stdin_text is not None else None,
-                    cwd=cwd, text=True, bufsize=1,
-                    env=_sanitized_env(),
-                    encoding=locale.getpreferredencoding(False),
-                    errors="replace"
-                )
-            except Exception as e:
-                (sink or self.add)(f"Error launching '{cmd}': {e}")
+                more = tab._fill_wrap_index(WRAP_FILL_CHUNK)
+            except Exception:
+                more = False
+            if more:
+                with _WRAP_FILL_LOCK:
+                    _WRAP_FILL_TABS.add(tab)
+            else:
+                _wake_ui()
+        time.sleep(0)
+
+
+
+def _schedule_wrap_fill(tab):
+    global _wrap_filler
+    with _WRAP_FILL_LOCK:
+        _WRAP_FILL_TABS.add(tab)
+        if _wrap_filler is None or not _wrap_filler.is_alive():
+            _wrap_filler = threading.Thread(target=_wrap_fill_loop, daemon=True)
+            _wrap_filler.start()
+    _WRAP_FILL_EVENT.set()
+
+
+
+class _LineCoalescer:
+    def __init__(self, target, max_lines=None, interval_ms=None, policy='block', capacity=None, stats=None, downstream=None):
+        self.target = target
+        self.downstream = downstream
+        self.max_lines = max_lines or COALESCE_MAX_LINES
+        self.interval = (interval_ms or COALESCE_INTERVAL_MS) / 1000.0
+        self.policy = policy
+        self.capacity = max(capacity or OUTPUT_QUEUE_LINES, self.max_lines)
+        self.stats = stats
+        self._pending = []
+        self._overflow = None
+        self._overflow_seen = 0
+        self._waiters = []
+        self._closed = False
+        self._first_at = 0.0
+        self._lock = threading.Lock()
+        _register_coalescer(self)
+
+    def backlog(self):
+        return len(self._pending)
+
+    def full(self):
+        return self.policy == 'block' and len(self._pending) >= self.capacity and not self._closed
+
+    def extend(self, lines):
+        if not lines:
+            return False
+        with self._lock:
+            self._count("received", len(lines))
+            if not self._pending:
+                self._first_at = time.monotonic()
+            if self._overflow is not None:
+                self._spill_locked(lines)
+                return False
+            room = self.capacity - len(self._pending)
+            if room >= len(lines) or self.policy == 'block' or self._closed:
+                self._pending.extend(lines)
+                return self.policy == 'block' and len(self._pending) >= self.capacity and not self._closed
+            if room > 0:
+                self._pending.extend(lines[:room])
+                lines = lines[room:]
+            self._overflow = collections.deque(maxlen=max(1, self.capacity // 4))
+            self._overflow_seen = 0
+            self._spill_locked(lines)
+            return False
+
+    def _spill_locked(self, lines):
+        if self.policy == 'sample':
+            step = max(1, OUTPUT_SAMPLE_EVERY)
+            start = (-self._overflow_seen) % step
+            self._overflow.extend(lines[start::step])
+        else:
+            self._overflow.extend(lines)
+        self._overflow_seen += len(lines)
+
+    def _count(self, key, n):
+        if self.stats is not None and n:
+            with _OUTPUT_STATS_LOCK:
+                self.stats[key] = self.stats.get(key, 0) + n
+
+    def when_ready(self, callback):
+        with self._lock:
+            if len(self._pending) < self.capacity or self._closed:
+                ready = True
+            else:
+                self._waiters.append(callback)
+                ready = False
+        if ready:
+            callback()
+        else:
+            self._count("paused", 1)
+
+    def flush(self, stale_only=False, limit=None):
+        with self._lock:
+            if not self._pending and self._overflow is None:
+                return
+            if stale_only and len(self._pending) < self.max_lines and (time.monotonic() - self._first_at) < self.interval:
                 return
-            emit_func = sink or self.add
-            
-            def _read_stream(stream):
+            if self.downstream is not None and not self._closed and self.downstream.full():
+                return
+            self._flush_locked(limit)
+
+    def _flush_locked(self, limit=None):
+        if limit is None or limit >= len(self._pending):
+            batch, self._pending = self._pending, []
+        else:
+            batch, self._pending = self._pending[:limit], self._pending[limit:]
+        markers = 0
+        if not self._pending and self._overflow is not None:
+            kept = list(self._overflow)
+            dropped = self._overflow_seen - len(kept)
+            self._overflow = None
+            if dropped > 0:
+                self._count("dropped", dropped)
+                if self.policy == 'sample':
+                    batch.append(f"[... {dropped} lines dropped, sampled 1 in {max(1, OUTPUT_SAMPLE_EVERY)} ...]")
+                else:
+                    batch.append(f"[... {dropped} lines elided ...]")
+                markers = 1
+            batch.extend(kept)
+        self._first_at = time.monotonic()
+        waiters = []
+        if self._waiters and len(self._pending) < self.capacity // 2:
+            waiters, self._waiters = self._waiters, []
+        _PIPE_NOWAIT.active = True
+        try:
+            self.target(batch)
+            self._count("delivered", len(batch) - markers)
+        except Exception:
+            pass
+        finally:
+            _PIPE_NOWAIT.active = False
+        for callback in waiters:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                waiters, self._waiters = self._waiters, []
+            for callback in waiters:
                 try:
-                    for line in stream:
-                        if GLOBAL_SHUTDOWN.is_set() or self.is_cancelled():
-                            break
-                        emit_func(line.rstrip('\n'))
+                    callback()
                 except Exception:
                     pass
+            _unregister_coalescer(self)
 
-            t_out = threading.Thread(target=_read_stream, args=(proc.stdout,), daemon=True)
-            t_err = threading.Thread(target=_read_stream, args=(proc.stderr,), daemon=True)
-            t_out.start()
-            t_err.start()
-            with self.current_proc_lock:
-                self.current_proc = proc
-            if stdin_text is not None:
+
+
+def _coalesce_flush_loop():
+    global _coalesce_flusher
+    backlog = False
+    while not GLOBAL_SHUTDOWN.wait(0 if backlog else COALESCE_INTERVAL_MS / 1000.0):
+        if backlog:
+            time.sleep(0)
+        with _COALESCERS_LOCK:
+            pending = list(_COALESCERS)
+            if not pending:
+                _coalesce_flusher = None
+                return
+        backlog = False
+        for c in pending:
+            try:
+                c.flush(stale_only=True, limit=OUTPUT_DRAIN_LINES)
+                backlog = backlog or c.backlog() >= c.max_lines
+            except Exception:
+                pass
+
+
+
+def _register_coalescer(coalescer):
+    global _coalesce_flusher
+    with _COALESCERS_LOCK:
+        _COALESCERS.add(coalescer)
+        if _coalesce_flusher is None or not _coalesce_flusher.is_alive():
+            _coalesce_flusher = threading.Thread(target=_coalesce_flush_loop, daemon=True)
+            _coalesce_flusher.start()
+
+
+
+def _unregister_coalescer(coalescer):
+    with _COALESCERS_LOCK:
+        _COALESCERS.discard(coalescer)
+
+
+
+class _LinePipe:
+    def __init__(self, capacity=None, cancelled=None):
+        self.capacity = capacity or PIPE_BUFFER_LINES
+        self.cancelled = cancelled
+        self._lines = collections.deque()
+        self._staged = []
+        self._waiters = []
+        self._closed = False
+        self._abandoned = False
+        self._cond = threading.Condition()
+        self._stage_lock = threading.Lock()
+
+    def __call__(self, text):
+        for ln in str(text).splitlines():
+            self.append(ln)
+
+    def append(self, line):
+        with self._stage_lock:
+            self._staged.append(line)
+            if len(self._staged) < PIPE_BATCH_LINES:
+                return
+            staged, self._staged = self._staged, []
+        self.extend(staged, wait=not getattr(_PIPE_NOWAIT, "active", False))
+
+    @property
+    def abandoned(self):
+        return self._abandoned
+
+    def full(self):
+        return len(self._lines) >= self.capacity and not self._dead()
+
+    def _take_staged(self):
+        with self._stage_lock:
+            staged, self._staged = self._staged, []
+        return staged
+
+    def _dead(self):
+        if self._abandoned or GLOBAL_SHUTDOWN.is_set():
+            return True
+        try:
+            return bool(self.cancelled and self.cancelled())
+        except Exception:
+            return False
+
+    def extend(self, lines, wait=False):
+        if not lines:
+            return False
+        with self._cond:
+            while wait and len(self._lines) >= self.capacity and not self._dead():
+                self._cond.wait(0.2)
+            if wait and self._abandoned:
+                raise BrokenPipeError("pipe reader has exited")
+            if self._dead():
+                return False
+            if not self._lines:
+                self._cond.notify_all()
+            self._lines.extend(lines)
+            return len(self._lines) >= self.capacity
+
+    def when_ready(self, callback):
+        with self._cond:
+            ready = len(self._lines) < self.capacity or self._closed or self._abandoned
+            if not ready:
+                self._waiters.append(callback)
+        if ready:
+            callback()
+
+    def batches(self):
+        while True:
+            with self._cond:
+                while not self._lines and not self._closed and not self._dead():
+                    self._cond.wait(COALESCE_INTERVAL_MS / 1000.0)
+                    self._lines.extend(self._take_staged())
+                if not self._lines and self._closed:
+                    self._lines.extend(self._take_staged())
+                if self._dead() or not self._lines:
+                    break
+                batch = list(self._lines)
+                self._lines.clear()
+                waiters, self._waiters = self._waiters, []
+                self._cond.notify_all()
+            for callback in waiters:
                 try:
-                    if proc.stdin is not None:
-                        data = stdin_text
-                        if not data.endswith('\n'):
-                            data = data + '\n'
-                        proc.stdin.write(data)
-                        proc.stdin.flush()
-                        proc.stdin.close()
+                    callback()
                 except Exception:
                     pass
-            notified = False
-            start_wait = time.monotonic()
-            while True:
-                if GLOBAL_SHUTDOWN.is_set() or self.is_cancelled():
-                    try:
-                        if proc.poll() is None:
-                            proc.terminate()
-                            try:
-                                proc.wait(timeout=1.0)
-                            except Exception:
-                                pass
-                            if proc.poll() is None:
-                                proc.kill()
-                    except Exception:
-                        pass
-                    break
-                try:
-                    proc.wait(timeout=0.2)
-                    break
-                except subprocess.TimeoutExpired:
-                    if not notified and soft_timeout_seconds and soft_timeout_seconds > 0:
-                        if (time.monotonic() - start_wait) >= soft_timeout_seconds:
+            yield batch
+        self.abandon()
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def close(self):
+        staged = self._take_staged()
+        with self._cond:
+            if staged and not self._abandoned:
+                self._lines.extend(staged)
+            self._closed = True
+            self._cond.notify_all()
+
+    def abandon(self):
+        with self._cond:
+            self._abandoned = True
+            self._lines.clear()
+            waiters, self._waiters = self._waiters, []
+            self._cond.notify_all()
+        for callback in waiters:
+            try:
+                callback()
+            except Exception:
+                pass
+
+
+
+def _stdin_lines(source):
+    if source is None:
+        return iter(())
+    if isinstance(source, str):
+        return iter(source.splitlines())
+    return iter(source)
+
+
+
+def _stdin_chunks(source, encoding):
+    if isinstance(source, str):
+        data = source if source.endswith("\n") else source + "\n"
+        yield data.encode(encoding, errors="replace")
+        return
+    for batch in source.batches():
+        yield ("\n".join(batch) + "\n").encode(encoding, errors="replace")
+
+
+
+class _LineDecoder:
+    def __init__(self, encoding=None, errors="replace", universal=True):
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.errors = errors
+        self.universal = universal
+        try:
+            self._decoder = codecs.getincrementaldecoder(self.encoding)(errors)
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors)
+        self._parts = []
+        self._cr = False
+
+    def feed(self, data, final=False):
+        text = self._decoder.decode(data, final)
+        if self.universal:
+            if self._cr:
+                text = "\r" + text
+                self._cr = False
+            if text.endswith("\r") and not final:
+                text = text[:-1]
+                self._cr = True
+            if "\r" in text:
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if "\n" not in text:
+            if text:
+                self._parts.append(text)
+            return []
+        lines = text.split("\n")
+        if self._parts:
+            self._parts.append(lines[0])
+            lines[0] = "".join(self._parts)
+            self._parts = []
+        tail = lines.pop()
+        if tail:
+            self._parts.append(tail)
+        return lines
+
+    def finish(self):
+        lines = self.feed(b"", final=True)
+        if self._parts:
+            lines.append("".join(self._parts))
+            self._parts = []
+        return lines
+
+
+
+def _pending_bytes(fd):
+    if fcntl is None or not hasattr(termios, "FIONREAD"):
+        return 0
+    avail = array.array("i", [0])
+    try:
+        fcntl.ioctl(fd, termios.FIONREAD, avail, True)
+    except OSError:
+        return 0
+    return avail[0]
+
+
+
+def _read_available(fd):
+    data = os.read(fd, max(_pending_bytes(fd), IO_READ_CHUNK))
+    if not data:
+        return data
+    parts = [data]
+    total = len(data)
+    while total < IO_READ_CHUNK_MAX:
+        avail = _pending_bytes(fd)
+        if avail <= 0:
+            break
+        try:
+            data = os.read(fd, min(avail, IO_READ_CHUNK_MAX - total))
+        except OSError:
+            break
+        if not data:
+            break
+        parts.append(data)
+        total += len(data)
+    return parts[0] if len(parts) == 1 else b"".join(parts)
+
+
+
+def _read_chunk(fd, sizes):
+    size = sizes.get(fd)
+    if size is None:
+        try:
+            size = 0 if os.isatty(fd) else IO_READ_CHUNK
+        except OSError:
+            size = IO_READ_CHUNK
+        sizes[fd] = size
+    if size == 0:
+        return _read_available(fd)
+    data = os.read(fd, size)
+    if len(data) == size and size < IO_READ_CHUNK_MAX:
+        sizes[fd] = size * 2
+    return data
+
+
+
+def _grow_pipe(fd):
+    if fcntl is None:
+        return
+    setsz = getattr(fcntl, "F_SETPIPE_SZ", 1031 if sys.platform.startswith("linux") else None)
+    if setsz is None:
+        return
+    try:
+        fcntl.fcntl(fd, setsz, IO_PIPE_SIZE)
+    except OSError:
+        pass
+
+
+
+class _IOHub:
+    def __init__(self):
+        self.selectable = os.name != 'nt'
+        self._lock = threading.Lock()
+        self._pending = []
+        self._watches = []
+        self._paused = {}
+        self._sizes = {}
+        self._selector = None
+        self._wake_r = None
+        self._wake_w = None
+        if self.selectable:
+            try:
+                self._selector = selectors.DefaultSelector()
+                self._wake_r, self._wake_w = os.pipe()
+                os.set_blocking(self._wake_r, False)
+                os.set_blocking(self._wake_w, False)
+                self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+            except (OSError, ValueError):
+                self.selectable = False
+        if self.selectable:
+            threading.Thread(target=self._loop, daemon=True).start()
+
+    def register(self, fd, on_data, on_close=None, flow=None):
+        if not self.selectable:
+            t = threading.Thread(target=self._pump, args=(fd, on_data, on_close, flow), daemon=True)
+            t.start()
+            return t
+        os.set_blocking(fd, False)
+        with self._lock:
+            self._pending.append(("add", fd, (on_data, on_close, flow)))
+        self._wake()
+        return None
+
+    def _resume_later(self, fd):
+        with self._lock:
+            self._pending.append(("resume", fd, None))
+        self._wake()
+
+    def discard(self, fd):
+        if not self.selectable:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._pending.append(("remove", fd, None))
+        self._wake()
+
+    def watch_exit(self, proc, callback):
+        if not self.selectable:
+            def _wait():
+                callback(proc.wait())
+            t = threading.Thread(target=_wait, daemon=True)
+            t.start()
+            return t
+        with self._lock:
+            self._watches.append((proc, callback))
+        self._wake()
+        return None
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            pass
+
+    def _pump(self, fd, on_data, on_close, flow=None):
+        sizes = {}
+        try:
+            while True:
+                try:
+                    data = _read_chunk(fd, sizes)
+                except OSError:
+                    break
+                if not data:
+                    break
+                if on_data(data) and flow is not None:
+                    ready = threading.Event()
+                    flow.when_ready(ready.set)
+                    while not ready.wait(0.2):
+                        if GLOBAL_SHUTDOWN.is_set():
+                            break
+        finally:
+            if on_close is not None:
+                on_close()
+
+    def _close(self, fd):
+        self._sizes.pop(fd, None)
+        callbacks = self._paused.pop(fd, None)
+        if callbacks is None:
+            try:
+                callbacks = self._selector.unregister(fd).data
+            except (KeyError, ValueError, OSError):
+                return
+        on_close = callbacks[1]
+        if on_close is not None:
+            try:
+                on_close()
+            except Exception:
+                pass
+
+    def _apply_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            watching = bool(self._watches)
+        for op, fd, callbacks in pending:
+            if op == "remove":
+                self._close(fd)
+                continue
+            if op == "resume":
+                callbacks = self._paused.pop(fd, None)
+                if callbacks is None:
+                    continue
+            try:
+                self._selector.register(fd, selectors.EVENT_READ, callbacks)
+            except (KeyError, ValueError, OSError):
+                if callbacks[1] is not None:
+                    try:
+                        callbacks[1]()
+                    except Exception:
+                        pass
+        return watching
+
+    def _reap(self):
+        with self._lock:
+            watches = list(self._watches)
+        finished = []
+        for proc, callback in watches:
+            try:
+                code = proc.poll()
+            except Exception:
+                code = -1
+            if code is not None:
+                finished.append((proc, callback, code))
+        if not finished:
+            return
+        for _ in range(64):
+            try:
+                events = self._selector.select(0)
+            except (OSError, ValueError):
+                break
+            if not any(key.data is not None for key, _ in events):
+                break
+            self._dispatch(events)
+        with self._lock:
+            done = set(id(p) for p, _, _ in finished)
+            self._watches = [w for w in self._watches if id(w[0]) not in done]
+        for _, callback, code in finished:
+            try:
+                callback(code)
+            except Exception:
+                pass
+
+    def _loop(self):
+        sel = self._selector
+        while not GLOBAL_SHUTDOWN.is_set():
+            watching = self._apply_pending()
+            try:
+                events = sel.select((IO_REAP_INTERVAL_MS / 1000.0) if watching else None)
+            except (OSError, ValueError):
+                events = []
+            self._dispatch(events)
+            if watching:
+                self._reap()
+
+    def _dispatch(self, events):
+        for key, _ in events:
+            if key.data is None:
+                try:
+                    while os.read(self._wake_r, 4096):
+                        pass
+                except OSError:
+                    pass
+                continue
+            try:
+                data = _read_chunk(key.fd, self._sizes)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b""
+            if not data:
+                self._close(key.fd)
+                continue
+            try:
+                full = key.data[0](data)
+            except Exception:
+                full = False
+            if full and key.data[2] is not None:
+                self._pause(key.fd, key.data)
+
+    def _pause(self, fd, callbacks):
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError, OSError):
+            return
+        self._paused[fd] = callbacks
+        callbacks[2].when_ready(lambda: self._resume_later(fd))
+
+
+
+def _io_hub():
+    global _IO_HUB
+    with _IO_HUB_LOCK:
+        if _IO_HUB is None:
+            _IO_HUB = _IOHub()
+        return _IO_HUB
+
+
+
+class _AsyncEngine:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._readers = {}
+        self._sizes = {}
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        if os.name != 'nt' and sys.version_info < (3, 12) and hasattr(os, "pidfd_open"):
+            try:
+                os.close(os.pidfd_open(os.getpid()))
+                watcher = asyncio.PidfdChildWatcher()
+                watcher.attach_loop(self.loop)
+                asyncio.set_child_watcher(watcher)
+            except (OSError, AttributeError, NotImplementedError):
+                pass
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        future = concurrent.futures.Future()
+        future.settled = threading.Event()
+
+        def _finish(task):
+            try:
+                if future.cancelled():
+                    return
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            except concurrent.futures.InvalidStateError:
+                pass
+            finally:
+                future.settled.set()
+
+        def _start():
+            if future.cancelled():
+                coro.close()
+                future.settled.set()
+                return
+            task = self.loop.create_task(coro)
+            task.add_done_callback(_finish)
+            future.add_done_callback(lambda f: f.cancelled() and self.loop.call_soon_threadsafe(task.cancel))
+
+        self.loop.call_soon_threadsafe(_start)
+        return future
+
+    def register(self, fd, on_data, on_close=None, flow=None):
+        if os.name == 'nt':
+            return _io_hub().register(fd, on_data, on_close, flow)
+        os.set_blocking(fd, False)
+        self.loop.call_soon_threadsafe(self._add_reader, fd, on_data, on_close, flow)
+        return None
+
+    def discard(self, fd):
+        if os.name == 'nt':
+            _io_hub().discard(fd)
+            return
+        self.loop.call_soon_threadsafe(self._remove_reader, fd)
+
+    def watch_exit(self, proc, callback):
+        if os.name == 'nt':
+            return _io_hub().watch_exit(proc, callback)
+        self.loop.call_soon_threadsafe(self._poll_exit, proc, callback)
+        return None
+
+    def _add_reader(self, fd, on_data, on_close, flow=None):
+        self._readers[fd] = (on_data, on_close, flow)
+        try:
+            self.loop.add_reader(fd, self._on_readable, fd)
+        except (OSError, ValueError):
+            self._remove_reader(fd)
+
+    def _on_readable(self, fd):
+        entry = self._readers.get(fd)
+        if entry is None:
+            return False
+        try:
+            data = _read_chunk(fd, self._sizes)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b""
+        if not data:
+            self._remove_reader(fd)
+            return False
+        try:
+            full = entry[0](data)
+        except Exception:
+            full = False
+        if full and entry[2] is not None:
+            self.loop.remove_reader(fd)
+            entry[2].when_ready(lambda: self.loop.call_soon_threadsafe(self._resume, fd))
+            return False
+        return True
+
+    def _resume(self, fd):
+        if fd in self._readers:
+            try:
+                self.loop.add_reader(fd, self._on_readable, fd)
+            except (OSError, ValueError):
+                self._remove_reader(fd)
+
+    def _remove_reader(self, fd):
+        self._sizes.pop(fd, None)
+        entry = self._readers.pop(fd, None)
+        if entry is None:
+            return
+        try:
+            self.loop.remove_reader(fd)
+        except (OSError, ValueError):
+            pass
+        if entry[1] is not None:
+            try:
+                entry[1]()
+            except Exception:
+                pass
+
+    def _poll_exit(self, proc, callback):
+        try:
+            code = proc.poll()
+        except Exception:
+            code = -1
+        if code is None:
+            self.loop.call_later(IO_REAP_INTERVAL_MS / 1000.0, self._poll_exit, proc, callback)
+            return
+        for _ in range(64):
+            if not any([self._on_readable(fd) for fd in list(self._readers)]):
+                break
+        try:
+            callback(code)
+        except Exception:
+            pass
+
+
+
+async def _flow_ready(flow):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def _set():
+        if not ready.done():
+            ready.set_result(None)
+    flow.when_ready(lambda: loop.call_soon_threadsafe(_set))
+    await ready
+
+
+
+async def _async_exited(proc, timeout):
+    deadline = time.monotonic() + timeout
+    while proc.returncode is None and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    return proc.returncode is not None
+
+
+
+def _async_engine():
+    global _ASYNC_ENGINE
+    with _ASYNC_ENGINE_LOCK:
+        if _ASYNC_ENGINE is None:
+            _ASYNC_ENGINE = _AsyncEngine()
+        return _ASYNC_ENGINE
+
+
+
+def _exec_owner():
+    return _async_engine() if EXEC_ENGINE == 'asyncio' else _io_hub()
+
+
+
+class _AsyncProcHandle:
+    def __init__(self, proc):
+        self._proc = proc
+        self.pid = proc.pid
+
+    def poll(self):
+        return self._proc.returncode
+
+    def _send(self, sig):
+        if self._proc.returncode is not None:
+            return
+        try:
+            if os.name == "nt":
+                self._proc.send_signal(sig)
+            else:
+                os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        self._send(signal.SIGTERM)
+
+    def kill(self):
+        self._send(signal.SIGTERM if os.name == "nt" else signal.SIGKILL)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._proc.returncode is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(self.pid, timeout)
+            time.sleep(0.02)
+        return self._proc.returncode
+
+
+
+class _ProcChain:
+    def __init__(self, procs, usage=None):
+        self.procs = procs
+        self.usage = usage
+        self.pid = procs[-1].pid
+
+    @property
+    def returncode(self):
+        return self.procs[-1].returncode
+
+    def poll(self):
+        codes = [p.poll() for p in self.procs]
+        return None if None in codes else codes[-1]
+
+    def terminate(self):
+        for p in self.procs:
+            try:
+                if p.poll() is None:
+                    p.terminate()
+            except OSError:
+                pass
+
+    def kill(self):
+        for p in self.procs:
+            try:
+                if p.poll() is None:
+                    p.kill()
+            except OSError:
+                pass
+
+    def discard(self):
+        self.kill()
+        for p in self.procs:
+            for stream in (p.stdin, p.stdout, p.stderr):
+                if stream is not None:
+                    try:
+                        stream.close()
+                    except OSError:
+                        pass
+            try:
+                p.wait()
+            except OSError:
+                pass
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for p in self.procs:
+            _wait_child(p, None if deadline is None else max(0.0, deadline - time.monotonic()), self.usage)
+        return self.procs[-1].returncode
+
+
+
+class _Job:
+    def __init__(self, job_id, tab, command, background):
+        self.id = job_id
+        self.tab = tab
+        self.command = command
+        self.background = background
+        self.cancel_event = threading.Event()
+        self.hooks = set()
+        self.procs = set()
+        self.future = None
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    @property
+    def status(self):
+        if self.finished is not None:
+            if self.error is not None:
+                return "failed"
+            return "cancelled" if self.cancel_event.is_set() else "done"
+        return "running" if self.started is not None else "queued"
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.finished = time.monotonic()
+            _wake_ui()
+        for hook in list(self.hooks):
+            try:
+                hook()
+            except Exception:
+                pass
+
+
+
+def _job_executor():
+    global _JOB_EXECUTOR
+    with _JOB_EXECUTOR_LOCK:
+        if _JOB_EXECUTOR is None:
+            _JOB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                max_workers=JOB_WORKERS, thread_name_prefix="poly-job"
+            )
+        return _JOB_EXECUTOR
+
+
+
+def _release_background_slot(slot):
+    with _JOB_EXECUTOR_LOCK:
+        _BACKGROUND_SLOTS.discard(slot)
+
+
+
+def _job_thread(fn):
+    future = concurrent.futures.Future()
+
+    def _target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=_target, daemon=True, name="poly-job").start()
+    return future
+
+
+
+def _current_job():
+    return getattr(_CURRENT_JOB, "job", None)
+
+
+
+class _Usage:
+    def __init__(self, command):
+        self.command = command
+        self.key = _usage_key(command)
+        self.started = time.monotonic()
+        self.wall = 0.0
+        self.utime = 0.0
+        self.stime = 0.0
+        self.maxrss = None
+        self.approximate = False
+        self._lock = threading.Lock()
+
+    def add_cpu(self, utime, stime):
+        with self._lock:
+            self.utime += max(0.0, utime)
+            self.stime += max(0.0, stime)
+
+    def add_child(self, ru):
+        rss = ru.ru_maxrss
+        if sys.platform.startswith("linux") and resource is not None:
+            if rss <= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+                rss = None
+        with self._lock:
+            self.utime += ru.ru_utime
+            self.stime += ru.ru_stime
+            if rss is not None:
+                rss *= 1 if sys.platform == "darwin" else 1024
+                self.maxrss = max(self.maxrss or 0, rss)
+
+    def finish(self):
+        self.wall = time.monotonic() - self.started
+
+    def summary(self):
+        mark = "~" if self.approximate else ""
+        text = f"real {self.wall:.3f}s  user {mark}{self.utime:.3f}s  sys {mark}{self.stime:.3f}s"
+        if self.maxrss is not None:
+            text += f"  maxrss {_format_size(self.maxrss)}"
+        return text
+
+
+
+def _format_size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024.0
+
+
+
+def _usage_key(cmd_line):
+    keys = []
+    for stage in cmd_line.split("|"):
+        words = stage.split()
+        if not words:
+            continue
+        key = words[0].lower()
+        if key == "run" and len(words) > 1:
+            key += " " + os.path.basename(words[1].lstrip("!"))
+        keys.append(key)
+    return " | ".join(keys)
+
+
+
+def _current_usage():
+    return getattr(_ACCOUNTING, "usage", None)
+
+
+
+def _thread_cpu():
+    if resource is not None and hasattr(resource, "RUSAGE_THREAD"):
+        try:
+            ru = resource.getrusage(resource.RUSAGE_THREAD)
+            return ru.ru_utime, ru.ru_stime
+        except OSError:
+            pass
+    return time.thread_time(), 0.0
+
+
+
+def _children_cpu():
+    if resource is None:
+        return 0.0, 0.0
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime, ru.ru_stime
+
+
+
+def _wait_child(proc, timeout=None, usage=None):
+    lock = getattr(proc, "_waitpid_lock", None)
+    if usage is None or lock is None or not hasattr(os, "wait4") or not isinstance(proc, subprocess.Popen):
+        return proc.wait(timeout)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.0005
+    while True:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        if not lock.acquire(timeout=-1 if remaining is None else remaining):
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+        try:
+            if proc.returncode is not None:
+                return proc.returncode
+            pid, status, ru = os.wait4(proc.pid, 0 if deadline is None else os.WNOHANG)
+            if pid:
+                proc.returncode = os.waitstatus_to_exitcode(status)
+        except ChildProcessError:
+            pid = None
+        except InterruptedError:
+            continue
+        finally:
+            lock.release()
+        if pid is None:
+            return proc.wait(timeout)
+        if pid:
+            usage.add_child(ru)
+            return proc.returncode
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+
+
+
+class Tab:
+    def __init__(self, name="New Tab", load_plugins_on_init=True):
+        self.name = name
+        self.mode = 'poly'
+        self.cwd = os.getcwd()
+        self.buffer = _Scrollback(SCROLLBACK_HOT_LINES, limit=MAX_BUFFER_LINES)
+        self.scrollback_mode = 'memory'
+        self.history = []
+        self.scroll = 0
+        self.color_settings = {}
+        self._next_color_pair = 3
+        self.lock = threading.Lock()
+        self.shell_proc = None
+        self.readers = []
+        self.workers = []
+        self.stdin_lock = threading.Lock()
+        self.wrap_index = None
+        self.version = 0
+        self.plugins = ensure_plugins_loaded(self) if load_plugins_on_init else list(_LOADED_PLUGINS)
+        self.procs = set()
+        self.current_proc_lock = threading.Lock()
+        self.pending_last_picker = False
+        self._cancel_event = threading.Event()
+        self._cancel_hooks = set()
+        self._io_owner = None
+        self.jobs = collections.OrderedDict()
+        self.output_policy = OUTPUT_POLICY
+        self.output_limit = OUTPUT_QUEUE_LINES
+        self.output_stats = {}
+        self.jobs_lock = threading.Lock()
+        self._next_job_id = 1
+        self.usage_stats = {}
+        self.usage_lock = threading.Lock()
+        if SCROLLBACK_MODE == 'disk':
+            try:
+                self.buffer.replace_cold(_DiskSpill(SCROLLBACK_SPILL_DIR), None)
+                self.scrollback_mode = 'disk'
+            except Exception:
+                pass
+
+    def add(self, text):
+        self.add_many(text.split('\n'))
+
+    def add_many(self, lines):
+        if not lines:
+            return
+        with self.lock:
+            self.version += 1
+            index = self.wrap_index
+            for line in lines:
+                evicted = self.buffer.append(line)
+                if index is not None:
+                    index.append()
+                    if evicted:
+                        self.scroll = max(0, self.scroll - index.drop_front())
+            if CLI_MODE:
+                print("\n".join(lines), flush=True)
+        if index is not None:
+            _schedule_wrap_fill(self)
+        _wake_ui()
+    
+    def clear(self):
+        with self.lock:
+            self.buffer.clear()
+            self.wrap_index = None
+            self.scroll = 0
+            self.version += 1
+        _wake_ui()
+
+    def _ensure_wrap_cache(self, width):
+        if self.wrap_index is None or self.wrap_index.width != width:
+            self.wrap_index = _WrapIndex(width, len(self.buffer))
+            _schedule_wrap_fill(self)
+        return self.wrap_index
+
+    def _fill_wrap_index(self, budget):
+        with self.lock:
+            index = self.wrap_index
+            if index is None:
+                return False
+            counts = index.counts
+            k = max(index.fill_pos, index.head)
+            end = len(counts)
+            while k < end and counts[k]:
+                k += 1
+            if k >= end:
+                index.fill_pos = k
+                return False
+            start = k - index.head
+            stop = min(start + budget, len(index))
+            width = index.width
+            for i, line in enumerate(self.buffer.iter_range(start, stop), start):
+                if not counts[index.head + i]:
+                    index.set_count(i, len(_wrap_display_line(line, width) or [""]))
+            index.fill_pos = index.head + stop
+            return index.fill_pos < len(counts)
+
+    def set_scrollback(self, mode, sink=None):
+        emit = sink or self.add
+        m = mode.lower()
+        if m not in ('memory', 'disk'):
+            emit(f"Invalid scrollback mode: {mode}")
+            return
+        error = None
+        with self.lock:
+            if m != self.scrollback_mode:
+                cold = self.buffer.cold
+                if m == 'disk':
+                    try:
+                        store = _DiskSpill(SCROLLBACK_SPILL_DIR)
+                    except Exception as e:
+                        error = e
+                    else:
+                        for line in cold:
+                            store.append(line)
+                        self.buffer.replace_cold(store, None)
+                else:
+                    store = _BlockStore()
+                    keep = max(MAX_BUFFER_LINES - len(self.buffer.hot), 0)
+                    for line in cold.iter_range(max(len(cold) - keep, 0), len(cold)):
+                        store.append(line)
+                    self.buffer.replace_cold(store, MAX_BUFFER_LINES)
+                if error is None:
+                    self.scrollback_mode = m
+                    self.wrap_index = None
+                    self.version += 1
+        if error is not None:
+            emit(f"scrollback: cannot create spill file: {error}")
+            return
+        emit(f"Scrollback mode set to {m}")
+
+    def request_cancel(self):
+        self._signal_cancel()
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.finished is None:
+                job.cancel()
+
+    def _signal_cancel(self):
+        self._cancel_event.set()
+        for hook in list(self._cancel_hooks):
+            try:
+                hook()
+            except Exception:
+                pass
+
+    def _submit_async(self, coro, wait=False):
+        self.clear_cancel()
+        future = _async_engine().submit(coro)
+        job = self._own_job()
+        hooks = job.hooks if job is not None else self._cancel_hooks
+        hook = future.cancel
+        hooks.add(hook)
+        future.add_done_callback(lambda f: hooks.discard(hook))
+        if job is not None and job.cancel_event.is_set():
+            future.cancel()
+        if wait or job is not None:
+            try:
+                future.result()
+            except concurrent.futures.CancelledError:
+                future.settled.wait()
+        return future
+
+    def clear_cancel(self):
+        self._cancel_event.clear()
+
+    def is_cancelled(self) -> bool:
+        job = self._own_job()
+        if job is not None:
+            return job.cancel_event.is_set()
+        return self._cancel_event.is_set()
+
+    def _own_job(self):
+        job = _current_job()
+        return job if job is not None and job.tab is self else None
+
+    def start_job(self, command, fn, background=False):
+        slot = None
+        if background:
+            with _JOB_EXECUTOR_LOCK:
+                if len(_BACKGROUND_SLOTS) >= JOB_WORKERS:
+                    self.add(f"jobs: {JOB_WORKERS} background jobs are already running; wait for one to finish")
+                    return None
+                slot = object()
+                _BACKGROUND_SLOTS.add(slot)
+        with self.jobs_lock:
+            job = _Job(self._next_job_id, self, command, background)
+            self._next_job_id += 1
+            self.jobs[job.id] = job
+            finished = [j for j in self.jobs.values() if j.finished is not None]
+            for old in finished[:max(0, len(finished) - JOB_HISTORY)]:
+                self.jobs.pop(old.id, None)
+
+        def _run():
+            _CURRENT_JOB.job = job
+            job.started = time.monotonic()
+            try:
+                if not job.cancel_event.is_set():
+                    fn()
+            except Exception as e:
+                job.error = e
+            finally:
+                _CURRENT_JOB.job = None
+                job.finished = time.monotonic()
+                if job.background:
+                    self.add(f"[{job.id}] {job.status} ({job.elapsed():.1f}s) {job.command}")
+                _wake_ui()
+
+        if background:
+            job.future = _job_executor().submit(_run)
+            job.future.add_done_callback(lambda f: _release_background_slot(slot))
+        else:
+            job.future = _job_thread(_run)
+        return job
+
+    def foreground_job(self):
+        with self.jobs_lock:
+            for job in self.jobs.values():
+                if not job.background and job.finished is None:
+                    return job
+        return None
+
+    def cancel_foreground(self):
+        job = self.foreground_job()
+        if job is None:
+            self._signal_cancel()
+            return
+        job.cancel()
+
+    def record_usage(self, usage):
+        with self.usage_lock:
+            entry = self.usage_stats.get(usage.key)
+            if entry is None:
+                entry = self.usage_stats[usage.key] = {"count": 0, "wall": 0.0, "user": 0.0, "sys": 0.0, "maxrss": None,
+                                                          "approximate": False}
+            entry["count"] += 1
+            entry["wall"] += usage.wall
+            entry["user"] += usage.utime
+            entry["sys"] += usage.stime
+            entry["approximate"] = entry["approximate"] or usage.approximate
+            if usage.maxrss is not None:
+                entry["maxrss"] = max(entry["maxrss"] or 0, usage.maxrss)
+
+    def show_stats(self, sink=None):
+        emit = sink or self.add
+        with self.usage_lock:
+            rows = sorted(((k, dict(v)) for k, v in self.usage_stats.items()), key=lambda kv: -kv[1]["wall"])
+        if not rows:
+            emit("stats: no commands recorded")
+            return
+        count = sum(v["count"] for _, v in rows)
+        wall = sum(v["wall"] for _, v in rows)
+        user = sum(v["user"] for _, v in rows)
+        system = sum(v["sys"] for _, v in rows)
+        mark = "~" if any(v["approximate"] for _, v in rows) else ""
+        emit(f"stats: {count} commands, real {wall:.3f}s, user {mark}{user:.3f}s, sys {mark}{system:.3f}s")
+        emit(f"{'command':<24} {'count':>6} {'real':>10} {'user':>10} {'sys':>10} {'maxrss':>10}")
+        for key, v in rows:
+            rss = _format_size(v["maxrss"]) if v["maxrss"] is not None else "-"
+            mark = "~" if v["approximate"] else ""
+            user = f"{mark}{v['user']:.3f}s"
+            system = f"{mark}{v['sys']:.3f}s"
+            emit(f"{key[:24]:<24} {v['count']:>6} {v['wall']:>9.3f}s {user:>10} {system:>10} {rss:>10}")
+
+    def show_jobs(self, sink=None):
+        emit = sink or self.add
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        if not jobs:
+            emit("jobs: no jobs")
+            return
+        for job in jobs:
+            mark = "&" if job.background else " "
+            emit(f"[{job.id}]{mark} {job.status:<9} {job.elapsed():7.1f}s  {job.command}")
+
+    def wait_jobs(self, job_id=None, sink=None):
+        emit = sink or self.add
+        me = self._own_job()
+        with self.jobs_lock:
+            if job_id is None:
+                targets = [j for j in self.jobs.values() if j.finished is None and j is not me]
+            else:
+                targets = [j for j in self.jobs.values() if j.id == job_id]
+        if job_id is not None and not targets:
+            emit(f"wait: no such job: {job_id}")
+            return
+        if me is not None and me in targets:
+            emit("wait: a job cannot wait for itself")
+            return
+        for job in targets:
+            while job.finished is None:
+                if self.is_cancelled() or GLOBAL_SHUTDOWN.is_set():
+                    return
+                try:
+                    job.future.result(timeout=0.2)
+                except concurrent.futures.TimeoutError:
+                    continue
+                except Exception:
+                    break
+                while job.finished is None:
+                    time.sleep(0.01)
+            if not job.background:
+                emit(f"[{job.id}] {job.status} ({job.elapsed():.1f}s) {job.command}")
+
+    def kill_job(self, job_id, sink=None):
+        emit = sink or self.add
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            emit(f"kill: no such job: %{job_id}")
+            return
+        if job.finished is not None:
+            emit(f"kill: job %{job_id} has already finished")
+            return
+        job.cancel()
+        emit(f"[{job.id}] cancelling {job.command}")
+
+    def wrapped_row_count(self, width, resolve_rows=0):
+        with self.lock:
+            index = self._ensure_wrap_cache(width)
+            if resolve_rows > 0:
+                index.resolve_tail(resolve_rows, self.buffer.__getitem__)
+            return index.total
+
+    def get_view(self, width, offset, rows):
+        with self.lock:
+            index = self._ensure_wrap_cache(width)
+            offset = max(offset, 0)
+            rows = max(rows, 0)
+            index.resolve_tail(offset + rows, self.buffer.__getitem__)
+            total = index.total
+            offset = min(offset, max(total - rows, 0))
+            start = max(total - rows - offset, 0)
+            return total, self._rows_locked(index, start, start + rows)
+
+    def _rows_locked(self, index, start, stop):
+        start = max(start, 0)
+        stop = min(stop, index.total)
+        out = []
+        if start >= stop:
+            return out
+        i, skip = index.locate(start)
+        need = stop - start
+        for line in self.buffer.iter_range(i, min(i + need, len(index))):
+            rows = index.rows_for(i, line)
+            take = rows[skip:skip + need]
+            out.extend(take)
+            need -= len(take)
+            skip = 0
+            i += 1
+            if need <= 0:
+                break
+        return out
+
+    def run_exec(self, program, sink=None, synchronous=None, stdin_text=None, soft_timeout_seconds=5.0):
+        usage = _current_usage()
+        job = self._own_job()
+
+        def _worker(cmds, cwd):
+            self.clear_cancel()
+            procs = []
+            try:
+                for cmd in cmds:
+                    use_shell, cmd_to_run = self._exec_argv(cmd)
+                    if cmd_to_run is None:
+                        if procs:
+                            _ProcChain(procs).discard()
+                        self.add("run: no command provided")
+                        return
+                    upstream = procs[-1].stdout if procs else None
+                    procs.append(subprocess.Popen(
+                        cmd_to_run,
+                        shell=use_shell,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        stdin=upstream if procs else (subprocess.PIPE if stdin_text is not None else None),
+                        cwd=cwd, bufsize=0,
+                        env=_sanitized_env()
+                    ))
+                    if upstream is not None:
+                        upstream.close()
+            except Exception as e:
+                if procs:
+                    _ProcChain(procs).discard()
+                (sink or self.add)(f"Error launching '{cmd}': {e}")
+                return
+            proc = procs[0] if len(procs) == 1 else _ProcChain(procs, usage)
+            encoding = locale.getpreferredencoding(False)
+            writer = self._output_writer(sink)
+            hub = _io_hub()
+
+            def _attach(stream):
+                decoder = _LineDecoder(encoding)
+                closed = threading.Event()
+
+                def _on_data(data):
+                    if GLOBAL_SHUTDOWN.is_set() or self.is_cancelled():
+                        return False
+                    return writer.extend(decoder.feed(data))
+
+                def _on_close():
+                    try:
+                        if not (GLOBAL_SHUTDOWN.is_set() or self.is_cancelled()):
+                            tail = decoder.finish()
+                            if tail:
+                                writer.extend(tail)
+                    finally:
+                        try:
+                            stream.close()
+                        except Exception:
+                            pass
+                        closed.set()
+
+                _grow_pipe(stream.fileno())
+                hub.register(stream.fileno(), _on_data, _on_close, flow=writer)
+                return closed
+
+            streams_closed = [_attach(procs[-1].stdout)] + [_attach(p.stderr) for p in procs]
+            self._track_proc(job, proc)
+            stdin = procs[0].stdin
+            if stdin_text is not None and stdin is not None:
+                def _feed():
+                    try:
+                        for chunk in _stdin_chunks(stdin_text, encoding):
+                            stdin.write(chunk)
+                    except Exception:
+                        pass
+                    finally:
+                        try:
+                            stdin.close()
+                        except Exception:
+                            pass
+                threading.Thread(target=_feed, daemon=True).start()
+            notified = False
+            start_wait = time.monotonic()
+            while True:
+                if GLOBAL_SHUTDOWN.is_set() or self.is_cancelled() or getattr(writer, "abandoned", False):
+                    try:
+                        if proc.poll() is None:
+                            proc.terminate()
+                            try:
+                                _wait_child(proc, 1.0, usage)
+                            except Exception:
+                                pass
+                            if proc.poll() is None:
+                                proc.kill()
+                    except Exception:
+                        pass
+                    break
+                try:
+                    _wait_child(proc, 0.2, usage)
+                    break
+                except subprocess.TimeoutExpired:
+                    if not notified and soft_timeout_seconds and soft_timeout_seconds > 0:
+                        if (time.monotonic() - start_wait) >= soft_timeout_seconds:
+                            try:
+                                notice = self.add if isinstance(sink, _LinePipe) else (sink or self.add)
+                                notice("[press Esc (Poly) or Ctrl+C (process) to terminate]")
+                            except Exception:
+                                pass
+                            notified = True
+                    continue
+            for closed in streams_closed:
+                closed.wait()
+            writer.close()
+            self._untrack_proc(job, proc)
+            return proc.returncode
+        if EXEC_ENGINE == 'asyncio':
+            future = self._submit_async(self._run_exec_async(program, self.cwd, sink, stdin_text, soft_timeout_seconds, usage, job),
+                                        wait=CLI_MODE or (synchronous is True))
+            if future.done() and not future.cancelled():
+                return future.result()
+            return None
+        cmds = [program] if isinstance(program, str) else list(program)
+        if CLI_MODE or (synchronous is True) or job is not None:
+            return _worker(cmds, self.cwd)
+        else:
+            t = threading.Thread(target=_worker, args=(cmds, self.cwd), daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def _exec_argv(self, cmd):
+        stripped = cmd.lstrip()
+        if stripped.startswith("!"):
+            return True, stripped[1:].lstrip()
+        argv = shlex.split(cmd, posix=(os.name != 'nt'))
+        if not argv:
+            return False, None
+        argv[0] = _resolve_cmd_path(argv[0])
+        return False, argv
+
+    def _output_writer(self, sink=None):
+        if isinstance(sink, _LinePipe):
+            return sink
+        if sink is None:
+            return _LineCoalescer(self.add_many, policy=self.output_policy,
+                                  capacity=self.output_limit, stats=self.output_stats)
+        downstream = getattr(sink, "flow", None)
+        stats = None if isinstance(downstream, _LineCoalescer) else self.output_stats
+        return _LineCoalescer(self._batch_target(sink), capacity=self.output_limit, stats=stats,
+                              downstream=downstream)
+
+    def show_output_stats(self, sink=None):
+        emit = sink or self.add
+        with _OUTPUT_STATS_LOCK:
+            stats = dict(self.output_stats)
+        emit(f"output: policy {self.output_policy}, queue limit {self.output_limit} lines")
+        emit(f"output: {stats.get('received', 0)} received, {stats.get('delivered', 0)} delivered, "
+             f"{stats.get('dropped', 0)} dropped, {stats.get('paused', 0)} reader pauses")
+
+    def _batch_target(self, sink):
+        if sink is None:
+            return self.add_many
+        batch = getattr(sink, "batch", None)
+        if batch is not None:
+            return batch
+
+        def emit_batch(lines):
+            for ln in lines:
+                sink(ln)
+        return emit_batch
+
+    async def _run_exec_async(self, cmd, cwd, sink, stdin_text, soft_timeout_seconds, usage=None, job=None):
+        emit = sink or self.add
+        pipe = asyncio.subprocess.PIPE
+        cmds = [cmd] if isinstance(cmd, str) else list(cmd)
+        procs = []
+        upstream = None
+        cmd_to_run = ""
+        cpu_before = _children_cpu()
+        try:
+            for n, cmd in enumerate(cmds):
+                use_shell, cmd_to_run = self._exec_argv(cmd)
+                if cmd_to_run is None:
+                    raise ValueError("no command provided")
+                stdin = upstream if upstream is not None else (pipe if stdin_text is not None else None)
+                upstream = None
+                stdout = pipe
+                if n < len(cmds) - 1:
+                    upstream, stdout = os.pipe()
+                    _grow_pipe(stdout)
+                try:
+                    if use_shell:
+                        proc = await asyncio.create_subprocess_shell(
+                            cmd_to_run, stdout=stdout, stderr=pipe, stdin=stdin, cwd=cwd, env=_sanitized_env(),
+                            limit=IO_READ_CHUNK_MAX
+                        )
+                    else:
+                        proc = await asyncio.create_subprocess_exec(
+                            *cmd_to_run, stdout=stdout, stderr=pipe, stdin=stdin, cwd=cwd, env=_sanitized_env(),
+                            limit=IO_READ_CHUNK_MAX
+                        )
+                finally:
+                    if stdin not in (None, pipe):
+                        os.close(stdin)
+                    if stdout != pipe:
+                        os.close(stdout)
+                procs.append(proc)
+        except Exception as e:
+            if upstream is not None:
+                try:
+                    os.close(upstream)
+                except OSError:
+                    pass
+            if procs:
+                _ProcChain([_AsyncProcHandle(p) for p in procs]).kill()
+                for p in procs:
+                    await _async_exited(p, 1.0)
+            if cmd_to_run is None:
+                self.add("run: no command provided")
+            else:
+                emit(f"Error launching '{cmd}': {e}")
+            return
+        proc = procs[-1]
+        encoding = locale.getpreferredencoding(False)
+        writer = self._output_writer(sink)
+        broken = []
+
+        async def _pump(stream):
+            decoder = _LineDecoder(encoding)
+            while True:
+                data = await stream.read(IO_READ_CHUNK_MAX)
+                if not data:
+                    break
+                if GLOBAL_SHUTDOWN.is_set() or self.is_cancelled():
+                    continue
+                if getattr(writer, "abandoned", False):
+                    if not broken:
+                        broken.append(True)
+                        for p in procs:
                             try:
-                                (sink or self.add)("[press Esc (Poly) or Ctrl+C (process) to terminate]")
-                            except Exception:
+                                p.terminate()
+                            except ProcessLookupError:
                                 pass
-                            notified = True
                     continue
-            t_out.join()
-            t_err.join()
-            with self.current_proc_lock:
-                self.current_proc = None
-        if CLI_MODE or (synchronous is True):
-            _worker(program, self.cwd)
-        else:
-            t = threading.Thread(target=_worker, args=(program, self.cwd), daemon=True)
-            t.start()
-            self.workers.append(t)
+                if writer.extend(decoder.feed(data)):
+                    await _flow_ready(writer)
+            tail = decoder.finish()
+            if tail and not (GLOBAL_SHUTDOWN.is_set() or self.is_cancelled()):
+                writer.extend(tail)
+
+        handles = [_AsyncProcHandle(p) for p in procs]
+        handle = handles[0] if len(handles) == 1 else _ProcChain(handles)
+        self._track_proc(job, handle)
+
+        async def _feed():
+            loop = asyncio.get_running_loop()
+            chunks = _stdin_chunks(stdin_text, encoding)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(None, next, chunks, None)
+                    if chunk is None:
+                        break
+                    procs[0].stdin.write(chunk)
+                    await procs[0].stdin.drain()
+            except (OSError, ConnectionError):
+                pass
+            finally:
+                procs[0].stdin.close()
+
+        pumps = [asyncio.ensure_future(_pump(proc.stdout))] + [asyncio.ensure_future(_pump(p.stderr)) for p in procs]
+        feeder = None
+        if stdin_text is not None and procs[0].stdin is not None:
+            feeder = asyncio.ensure_future(_feed())
+        try:
+            waiter = asyncio.ensure_future(asyncio.gather(*(p.wait() for p in procs)))
+            if soft_timeout_seconds and soft_timeout_seconds > 0:
+                done, _ = await asyncio.wait({waiter}, timeout=soft_timeout_seconds)
+                if not done:
+                    (self.add if isinstance(sink, _LinePipe) else emit)("[press Esc (Poly) or Ctrl+C (process) to terminate]")
+            await waiter
+            await asyncio.gather(*pumps)
+            if usage is not None:
+                cpu_after = _children_cpu()
+                usage.add_cpu(cpu_after[0] - cpu_before[0], cpu_after[1] - cpu_before[1])
+                usage.approximate = True
+            return proc.returncode
+        except asyncio.CancelledError:
+            for p in procs:
+                if p.returncode is None:
+                    handle = _AsyncProcHandle(p)
+                    handle.terminate()
+                    if not await _async_exited(p, 1.0):
+                        handle.kill()
+                        await _async_exited(p, 1.0)
+            for task in pumps:
+                task.cancel()
+            if feeder is not None:
+                feeder.cancel()
+            return proc.returncode
+        finally:
+            writer.close()
+            self._untrack_proc(job, handle)
+
+    def parallel(self, commands, jobs=None, sink=None):
+        emit = sink or self.add
+        commands = [c.strip() for c in commands if c.strip()]
+        if not commands:
+            emit("parallel: no commands given")
+            return
+        workers = max(1, jobs or os.cpu_count() or 4)
+        parent = _current_job()
+        usage = _current_usage()
+        results = [None] * len(commands)
+        writer = self._output_writer(sink)
+
+        def _run_one(n):
+            _CURRENT_JOB.job = parent
+            _ACCOUNTING.usage = usage
+            cmd = commands[n]
+            if cmd.lower().startswith("run "):
+                cmd = cmd[4:].lstrip()
+            tag = f"[{n + 1}] "
+
+            def _tagged_batch(lines):
+                writer.extend([tag + ln for line in lines for ln in str(line).split("\n")])
+
+            def _tagged(line):
+                _tagged_batch([line])
+            _tagged.batch = _tagged_batch
+            _tagged.flow = writer
+            started = time.monotonic()
+            try:
+                if self.is_cancelled() or GLOBAL_SHUTDOWN.is_set():
+                    code = "skipped"
+                else:
+                    code = self.run_exec(cmd, sink=_tagged, synchronous=True)
+            except Exception as e:
+                _tagged(f"parallel: {e}")
+                code = None
+            finally:
+                _CURRENT_JOB.job = None
+                _ACCOUNTING.usage = None
+            results[n] = (code, time.monotonic() - started)
+
+        wall_start = time.monotonic()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(commands)),
+                                                       thread_name_prefix="poly-parallel") as pool:
+                list(pool.map(_run_one, range(len(commands))))
+        finally:
+            if writer is not sink:
+                writer.close()
+        wall = time.monotonic() - wall_start
+        ok = sum(1 for r in results if r and r[0] == 0)
+        total = sum(r[1] for r in results if r)
+        emit(f"parallel: {len(commands)} jobs, {ok} ok, {len(commands) - ok} failed, "
+             f"wall {wall:.2f}s (sum {total:.2f}s, -j {workers})")
+        for n, (code, took) in enumerate(results):
+            status = "error" if code is None else code if isinstance(code, str) else f"exit {code}"
+            emit(f"[{n + 1}] {status:<8} {took:7.2f}s  {commands[n]}")
 
     def cd(self, path, sink=None):
         emit = sink or self.add
@@ -642,46 +3208,16 @@ class Tab:
             if parsed.scheme not in ('http', 'https'):
                 emit(f"download: unsupported URL scheme")
                 return
-            local_name_raw = (os.path.basename(fn) if fn else os.path.basename(parsed.path)) or 'download'
-            
-            def _sanitize_download_name(name: str) -> str:
-                try:
-                    name = ''.join(ch for ch in name if unicodedata.category(ch) != 'Cc')
-                except Exception:
-                    pass
-                try:
-                    name = os.path.normpath(name)
-                except Exception:
-                    pass
-                try:
-                    name = os.path.basename(name)
-                except Exception:
-                    pass
-                for sep in (os.sep, os.altsep):
-                    if sep:
-                        name = name.replace(sep, '_')
-                name = name.strip().strip('.')
-                if not name or name in ('.', '..'):
-                    name = 'download'
-                return name
-
-            local_name = _sanitize_download_name(local_name_raw)
-            cwd_abs = os.path.abspath(self.cwd)
-            dest = os.path.abspath(os.path.join(cwd_abs, local_name))
-            try:
-                if os.path.commonpath([cwd_abs, dest]) != cwd_abs:
-                    dest = os.path.abspath(os.path.join(cwd_abs, 'download'))
-            except Exception:
-                dest = os.path.abspath(os.path.join(cwd_abs, 'download'))
+            dest = self._download_dest(parsed, fn)
             try:
-                MAX_BYTES = 50 * 1024 * 1024
-                TOTAL_TIMEOUT = 60
-                CHUNK = 64 * 1024
+                MAX_BYTES = DOWNLOAD_MAX_BYTES
+                TOTAL_TIMEOUT = DOWNLOAD_TOTAL_TIMEOUT
+                CHUNK = DOWNLOAD_CHUNK
                 start_time = time.monotonic()
                 aborted_reason = None
                 was_cancelled = False
 
-                with urlopen(u, timeout=15) as resp, open(dest, 'wb') as out:
+                with urlopen(u, timeout=DOWNLOAD_CONNECT_TIMEOUT) as resp, open(dest, 'wb') as out:
                     try:
                         info = getattr(resp, 'headers', None) or resp.info()
                         cl = info.get('Content-Length') if info else None
@@ -733,13 +3269,84 @@ class Tab:
                             os.remove(dest)
                     except Exception:
                         pass
-        if CLI_MODE or (synchronous is True):
+        if EXEC_ENGINE == 'asyncio':
+            self._submit_async(self._download_async(url, filename, sink), wait=CLI_MODE or (synchronous is True))
+            return
+        if CLI_MODE or (synchronous is True) or self._own_job() is not None:
             _worker(url, filename)
         else:
             t = threading.Thread(target=_worker, args=(url, filename), daemon=True)
             t.start()
             self.workers.append(t)
 
+    def _download_dest(self, parsed, fn):
+        local_name_raw = (os.path.basename(fn) if fn else os.path.basename(parsed.path)) or 'download'
+        local_name = _sanitize_download_name(local_name_raw)
+        cwd_abs = os.path.abspath(self.cwd)
+        dest = os.path.abspath(os.path.join(cwd_abs, local_name))
+        try:
+            if os.path.commonpath([cwd_abs, dest]) != cwd_abs:
+                dest = os.path.abspath(os.path.join(cwd_abs, 'download'))
+        except Exception:
+            dest = os.path.abspath(os.path.join(cwd_abs, 'download'))
+        return dest
+
+    async def _download_async(self, u, fn, sink):
+        from urllib.request import urlopen
+        from urllib.error import URLError
+        emit = sink or self.add
+        parsed = urllib.parse.urlparse(u)
+        if parsed.scheme not in ('http', 'https'):
+            emit("download: unsupported URL scheme")
+            return
+        dest = self._download_dest(parsed, fn)
+        loop = asyncio.get_running_loop()
+        outcome = None
+
+        async def _fetch():
+            resp = await loop.run_in_executor(None, functools.partial(urlopen, u, timeout=DOWNLOAD_CONNECT_TIMEOUT))
+            try:
+                cl = resp.headers.get("Content-Length")
+                if cl is not None and cl.isdigit() and int(cl) > DOWNLOAD_MAX_BYTES:
+                    return f"download: file too large ({int(cl)} bytes > {DOWNLOAD_MAX_BYTES} limit)"
+                total = 0
+                with open(dest, 'wb') as out:
+                    while True:
+                        chunk = await loop.run_in_executor(None, resp.read, DOWNLOAD_CHUNK)
+                        if not chunk:
+                            break
+                        total += len(chunk)
+                        if total > DOWNLOAD_MAX_BYTES:
+                            return f"download: file too large ({total} bytes > {DOWNLOAD_MAX_BYTES} limit)"
+                        out.write(chunk)
+                return None
+            finally:
+                resp.close()
+
+        try:
+            outcome = await asyncio.wait_for(_fetch(), DOWNLOAD_TOTAL_TIMEOUT)
+        except asyncio.CancelledError:
+            outcome = ""
+        except asyncio.TimeoutError:
+            outcome = f"download: total timeout exceeded ({DOWNLOAD_TOTAL_TIMEOUT}s)"
+        except (URLError, OSError, ValueError, EOFError) as e:
+            outcome = f"download: network error: {e}"
+        except Exception as e:
+            outcome = f"download: error saving file: {e}"
+        if outcome is None and (GLOBAL_SHUTDOWN.is_set() or self.is_cancelled()):
+            outcome = ""
+        if outcome is None:
+            emit(f"Downloaded {u} -> {dest}")
+            _invalidate_completion_cache()
+            return
+        try:
+            if os.path.exists(dest):
+                os.remove(dest)
+        except Exception:
+            pass
+        if outcome:
+            emit(outcome)
+
     def tree(self, path=None, sink=None, synchronous=None):
         def _worker(p):
             import os
@@ -788,7 +3395,7 @@ class Tab:
                         extension = "    " if is_last else "│   "
                         walk(full, prefix + extension)
             walk(target)
-        if CLI_MODE or (synchronous is True):
+        if CLI_MODE or (synchronous is True) or self._own_job() is not None:
             _worker(path)
         else:
             t = threading.Thread(target=_worker, args=(path,), daemon=True)
@@ -847,7 +3454,7 @@ class Tab:
     def read(self, path, sink=None, stdin_text=None):
         emit = sink or self.add
         if (path == '-' or not path) and stdin_text is not None:
-            for line in str(stdin_text).splitlines():
+            for line in _stdin_lines(stdin_text):
                 emit(line)
             return
         self.clear_cancel()
@@ -1036,6 +3643,7 @@ class Tab:
             start_x = max(0, (width - window_width) // 2)
             history_window = curses.newwin(window_height, window_width, start_y, start_x)
             history_window.keypad(True)
+            history_window.timeout(INPUT_POLL_MS)
             max_display = window_height - 4
 
         history_window = None
@@ -1067,11 +3675,13 @@ class Tab:
                     else:
                         history_window.addstr(i + 2, 2, display_text)
                 history_window.refresh()
-                key = history_window.getch()
+                key = -1
+                while key == -1 and not _RESIZE_PENDING.is_set():
+                    key = history_window.getch()
                 if key == 27:
                     return None
-                elif key == curses.KEY_RESIZE:
-                    curses.update_lines_cols()
+                elif key == -1:
+                    _apply_resize()
                     create_window()
                     max_display = max(1, max_display)
                     current_pos = min(current_pos, max_display - 1)
@@ -1195,73 +3805,72 @@ class Tab:
         osc_pattern = re.compile(r'\x1B\][^\x07\x1B]*(?:\x07|\x1B\\)')
 
         def _strip_ansi_targeted(s: str) -> str:
+            if '\x1b' not in s:
+                return s
             s = osc_pattern.sub('', s)
             s = csi_pattern.sub('', s)
             return s
 
-        def _reader(pipe):
-            for line in pipe:
+        hub = _exec_owner()
+        self._io_owner = hub
+        writers = []
+
+        def _attach(fd, decoder, on_close):
+            writer = self._output_writer()
+            writers.append(writer)
+
+            def _on_data(data):
                 if GLOBAL_SHUTDOWN.is_set() or self.is_cancelled():
-                    break
-                if not isinstance(line, str):
-                    try:
-                        line = line.decode(errors='ignore')
-                    except Exception:
-                        line = str(line)
-                clean_line = _strip_ansi_targeted(line).rstrip('\n')
-                if clean_line is not None:
-                    self.add(clean_line)
+                    return False
+                return writer.extend([_strip_ansi_targeted(ln) for ln in decoder.feed(data)])
 
-        if os.name != 'nt' and self.mode == 'lnx' and getattr(self, '_pty_master_fd', None) is not None:
-            def _pty_reader(fd):
-                buf = ""
+            def _on_close():
                 try:
-                    while True:
-                        if GLOBAL_SHUTDOWN.is_set() or self.is_cancelled():
-                            break
-                        try:
-                            chunk = os.read(fd, 1024)
-                        except OSError:
-                            break
-                        if not chunk:
-                            break
-                        try:
-                            text = chunk.decode(errors='ignore')
-                        except Exception:
-                            text = chunk.decode('utf-8', errors='ignore')
-                        buf += text
-                        while "\n" in buf:
-                            line, buf = buf.split("\n", 1)
-                            clean = _strip_ansi_targeted(line)
-                            if clean is not None:
-                                self.add(clean)
+                    tail = decoder.finish()
+                    if tail:
+                        writer.extend([_strip_ansi_targeted(ln) for ln in tail])
                 finally:
-                    if buf:
-                        clean_tail = _strip_ansi_targeted(buf)
-                        if clean_tail is not None:
-                            self.add(clean_tail)
-                    try:
-                        os.close(fd)
-                    except Exception:
-                        pass
-            t = threading.Thread(target=_pty_reader, args=(self._pty_master_fd,), daemon=True)
-            t.start()
-            self.readers.append(t)
+                    writer.close()
+                    on_close()
+
+            t = hub.register(fd, _on_data, _on_close, flow=writer)
+            if t is not None:
+                self.readers.append(t)
+
+        def _close_fd(fd):
+            def _close():
+                try:
+                    os.close(fd)
+                except Exception:
+                    pass
+            return _close
+
+        def _close_stream(stream):
+            def _close():
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            return _close
+
+        if os.name != 'nt' and self.mode == 'lnx' and getattr(self, '_pty_master_fd', None) is not None:
+            fd = self._pty_master_fd
+            _attach(fd, _LineDecoder("utf-8", errors="ignore", universal=False), _close_fd(fd))
         else:
+            encoding = locale.getpreferredencoding(False)
             for p in (self.shell_proc.stdout, self.shell_proc.stderr):
-                t = threading.Thread(target=_reader, args=(p,), daemon=True)
-                t.start()
-                self.readers.append(t)
+                _attach(p.fileno(), _LineDecoder(encoding), _close_stream(p))
 
-        def _waiter():
-            code = self.shell_proc.wait()
+        def _on_exit(code):
+            for writer in writers:
+                writer.flush()
             self.add(f"Exited (code {code}); reverting to Poly.")
             self.mode = 'poly'
             self.shell_proc = None
 
-        wt = threading.Thread(target=_waiter, daemon=True)
-        wt.start()
-        self.workers.append(wt)
+        wt = hub.watch_exit(self.shell_proc, _on_exit)
+        if wt is not None:
+            self.workers.append(wt)
 
     def write_input(self, text):
         if not self.shell_proc:
@@ -1302,7 +3911,7 @@ class Tab:
             try:
                 if os.name != 'nt' and getattr(self, '_pty_master_fd', None) is not None:
                     try:
-                        os.close(self._pty_master_fd)
+                        (self._io_owner or _io_hub()).discard(self._pty_master_fd)
                     except Exception:
                         pass
                     try:
@@ -1343,38 +3952,93 @@ class Tab:
                     pass
         finally:
             self.workers.clear()
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            try:
+                if job.future is not None and job.finished is None:
+                    concurrent.futures.wait([job.future], timeout=0.3)
+            except Exception:
+                pass
         try:
             self.clear_cancel()
         except Exception:
             pass
 
+    def _track_proc(self, job, proc):
+        with self.current_proc_lock:
+            (job.procs if job is not None else self.procs).add(proc)
+
+    def _untrack_proc(self, job, proc):
+        with self.current_proc_lock:
+            (job.procs if job is not None else self.procs).discard(proc)
+
     def stop_current_process(self):
+        job = self.foreground_job()
         with self.current_proc_lock:
-            proc = self.current_proc
-        if proc is None:
+            procs = list(job.procs if job is not None else self.procs)
+        procs = [p for p in procs if p.poll() is None]
+        if not procs:
             self.add("No running process to stop.")
             return
         try:
-            if proc.poll() is None:
+            for proc in procs:
                 proc.terminate()
+            for proc in procs:
                 try:
                     proc.wait(timeout=1.5)
                 except Exception:
                     pass
                 if proc.poll() is None:
                     proc.kill()
-            self.add("Stopped current process.")
+            self.add("Stopped current process." if len(procs) == 1 else f"Stopped {len(procs)} processes.")
         except Exception as e:
             self.add(f"Failed to stop process: {e}")
 
 
 
-def draw_layout(stdscr, tab):
+class _Renderer:
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.rows = {}
+        self.dirty = False
+        self._keys = {}
+        self._size = None
+
+    def invalidate(self):
+        self._keys.clear()
+        self.rows.clear()
+        self._size = None
+
+    def begin(self):
+        size = self.stdscr.getmaxyx()
+        self.dirty = False
+        if size != self._size or _FULL_REDRAW.is_set():
+            _FULL_REDRAW.clear()
+            self.invalidate()
+            self._size = size
+            self.stdscr.erase()
+            self.dirty = True
+        return size
+
+    def changed(self, region, key):
+        if self._keys.get(region) == key:
+            return False
+        self._keys[region] = key
+        self.dirty = True
+        return True
+
+
+
+def draw_header(stdscr, tab, now=None):
     h, w = stdscr.getmaxyx()
+    stdscr.move(0, 0)
+    stdscr.clrtoeol()
     left = "Poly"
     pid, bold = tab.color_settings.get("logotext", (1, curses.A_BOLD))
     stdscr.addstr(0, 0, left, curses.color_pair(pid) | bold)
-    now = datetime.datetime.now().strftime("%H:%M:%S")
+    if now is None:
+        now = datetime.datetime.now().strftime("%H:%M:%S")
     center_x = (w - len(now)) // 2
     pid, bold = tab.color_settings.get("clock", (1, curses.A_BOLD))
     stdscr.addstr(0, max(center_x, len(left) + 1), now,
@@ -1384,6 +4048,11 @@ def draw_layout(stdscr, tab):
     pid, bold = tab.color_settings.get("userinfo", (1, curses.A_BOLD))
     stdscr.addstr(0, max(right_x, len(left) + len(now) + 2), user_host,
                   curses.color_pair(pid) | bold)
+
+
+
+def draw_frame(stdscr, tab):
+    h, w = stdscr.getmaxyx()
     pid, bold = tab.color_settings.get("borders", (1, curses.A_NORMAL))
     border_attr = curses.color_pair(pid) | bold
 
@@ -1416,6 +4085,8 @@ def draw_sidebar(stdscr, tabs, current_idx):
             pid, bold = tab.color_settings.get("tab", (1, curses.A_NORMAL))
         attr = curses.color_pair(pid) | bold
         stdscr.addstr(row, 0, disp, attr)
+    for row in range(2 + len(tabs), h):
+        stdscr.addstr(row, 0, " " * width)
 
 
 
@@ -1430,22 +4101,26 @@ def wrap_lines(lines, width):
 
 
 
-def draw_messages(stdscr, tab):
+def draw_messages(stdscr, tab, drawn=None):
     h, w = stdscr.getmaxyx()
     max_row = h - 2
     available = max_row - 2
     width = max(w - VERTICAL_COL - 1, 0)
-    wrapped = tab.get_wrapped_lines(width)
-    length = len(wrapped)
-    with tab.lock:
-        offset = min(max(tab.scroll, 0), max(length - available, 0))
-    start = max(length - available - offset, 0)
-    msgs = wrapped[start:start + available]
+    if width <= 0 or VERTICAL_COL + 1 >= w:
+        return
+    _, msgs = tab.get_view(width, tab.scroll, available)
     pid, bold = tab.color_settings.get("output", (1, curses.A_NORMAL))
     attr = curses.color_pair(pid) | bold
-    for i, line in enumerate(msgs):
+    for i in range(max(available, 0)):
         y = 2 + i
-        if y < max_row and width > 0 and VERTICAL_COL + 1 < w:
+        line = msgs[i] if i < len(msgs) else ""
+        if drawn is not None:
+            if drawn.get(y) == (line, attr):
+                continue
+            drawn[y] = (line, attr)
+        stdscr.move(y, VERTICAL_COL + 1)
+        stdscr.clrtoeol()
+        if line:
             stdscr.addnstr(y, VERTICAL_COL + 1, line, width, attr)
 
 
@@ -1484,11 +4159,15 @@ def export_log(tab):
             return
         try:
             with open(path, "w", encoding="utf-8") as f, tab.lock:
-                f.write("\n".join(tab.buffer))
+                for i, line in enumerate(tab.buffer):
+                    if i:
+                        f.write("\n")
+                    f.write(line)
             tab.add(f"Exported to {path}")
         except Exception as e:
             tab.add(f"Export failed: {e}")
     finally:
+        _FULL_REDRAW.set()
         try:
             curses.reset_prog_mode()
             try:
@@ -1504,7 +4183,7 @@ def get_completions(inp, tabs, idx):
     global _completion_cache_key, _completion_cache_time, _completion_cache_results
     now = time.monotonic()
     cwd = tabs[idx].cwd
-    key = (inp, cwd)
+    key = (inp, cwd, _COMMAND_INDEX.version)
     if (now - _completion_cache_time) < (COMPLETION_DEBOUNCE_MS / 1000.0) and _completion_cache_key == key:
         return _completion_cache_results
     i = inp.rfind(' ')
@@ -1513,11 +4192,8 @@ def get_completions(inp, tabs, idx):
     else:
         base, token = inp[:i+1], inp[i+1:]
     cmd = inp.strip().split(' ', 1)[0].lower()
-    commands = ["tab", "run", "cd", "cwd", "files", "makedir", "deldir", "remove", "echo", "make", "download", "alias", "tree", "history", "color", "clear", "read", "move", "copy", "kill", "variable", "shutdown", "restart", "last", "env", "setenv", "unsetenv"]
-    for command in CUSTOM_COMMANDS.keys():
-        if not command.startswith("__"):
-            commands.append(command)
     if not inp.strip():
+        commands = _COMMAND_INDEX.complete("")
         _completion_cache_key = key
         _completion_cache_time = now
         _completion_cache_results = commands
@@ -1547,16 +4223,16 @@ def get_completions(inp, tabs, idx):
             _completion_cache_results = []
             return []
         try:
-            entries = os.listdir(dir_full)
+            entries = _dir_matches(dir_full, prefix, COMPLETION_MAX_RESULTS)
         except Exception:
             return []
-        matches = []
-        for e in entries:
-            if e.startswith(prefix):
-                sug = os.path.join(dir_part_disp, e) if dir_part_disp else e
-                full = base + sug + (sep if os.path.isdir(os.path.join(dir_full, e)) else '')
-                matches.append(full)
-        results = sorted(matches)[:COMPLETION_MAX_RESULTS]
+        results = []
+        for e, is_dir in entries:
+            sug = os.path.join(dir_part_disp, e) if dir_part_disp else e
+            results.append(base + sug + (sep if is_dir else ''))
+        if cmd == 'run' and len(base.split()) == 1 and not dir_part_disp and not is_tilde:
+            programs = [base + e for e in _PATH_INDEX.complete(prefix, COMPLETION_MAX_RESULTS)]
+            results = sorted(set(results).union(programs))[:COMPLETION_MAX_RESULTS]
         _completion_cache_key = key
         _completion_cache_time = now
         _completion_cache_results = results
@@ -1564,20 +4240,22 @@ def get_completions(inp, tabs, idx):
     parts = inp.strip().split()
     token = parts[-1] if not inp.endswith(' ') else ''
     if len(parts) == 1 and not inp.endswith(' '):
-        results = [o for o in commands if o.startswith(token)]
+        results = _COMMAND_INDEX.complete(token)
         _completion_cache_key = key
         _completion_cache_time = now
         _completion_cache_results = results
         return results
     if parts[0].lower() == "tab":
         if len(parts) == 1:
-            opts = ["title", "mode", "create", "delete", "export"]
+            opts = ["title", "mode", "scrollback", "create", "delete", "export"]
         else:
             sub = parts[1].lower()
             if len(parts) == 2 and not inp.endswith(' '):
-                opts = ["title", "mode", "create", "delete", "export"]
+                opts = ["title", "mode", "scrollback", "create", "delete", "export"]
             elif sub == "mode":
                 opts = ["win", "pws", "lnx"]
+            elif sub == "scrollback":
+                opts = ["memory", "disk"]
             elif sub in ("delete", "export"):
                 opts = [t.name for t in tabs]
             else:
@@ -1609,8 +4287,50 @@ def get_completions(inp, tabs, idx):
         _completion_cache_time = now
         _completion_cache_results = results
         return results
+    if parts[0].lower() == "stats":
+        if len(parts) == 1 or (len(parts) == 2 and not inp.endswith(' ')):
+            opts = ["reset", "footer"]
+        elif parts[1].lower() == "footer" and (len(parts) == 2 or (len(parts) == 3 and not inp.endswith(' '))):
+            opts = ["on", "off"]
+        else:
+            return []
+        results = [base + o for o in opts if o.startswith(token)]
+        _completion_cache_key = key
+        _completion_cache_time = now
+        _completion_cache_results = results
+        return results
+    if parts[0].lower() == "output":
+        if len(parts) == 1 or (len(parts) == 2 and not inp.endswith(' ')):
+            opts = ["policy", "limit", "reset"]
+        elif parts[1].lower() == "policy" and (len(parts) == 2 or (len(parts) == 3 and not inp.endswith(' '))):
+            opts = ["block", "elide", "sample"]
+        else:
+            return []
+        results = [base + o for o in opts if o.startswith(token)]
+        _completion_cache_key = key
+        _completion_cache_time = now
+        _completion_cache_results = results
+        return results
+    if parts[0].lower() == "engine":
+        if len(parts) > 2 or (len(parts) == 2 and inp.endswith(' ')):
+            return []
+        opts = ["threads", "asyncio"]
+        results = [base + o for o in opts if o.startswith(token)]
+        _completion_cache_key = key
+        _completion_cache_time = now
+        _completion_cache_results = results
+        return results
     if parts[0].lower() == "alias":
-        opts = commands
+        results = [base + o for o in _COMMAND_INDEX.complete(token)]
+        _completion_cache_key = key
+        _completion_cache_time = now
+        _completion_cache_results = results
+        return results
+    if parts[0].lower() == "completion":
+        if len(parts) == 1 or (len(parts) == 2 and not inp.endswith(' ')):
+            opts = ["budget"]
+        else:
+            return []
         results = [base + o for o in opts if o.startswith(token)]
         _completion_cache_key = key
         _completion_cache_time = now
@@ -1623,7 +4343,79 @@ def get_completions(inp, tabs, idx):
 
 
 
+class _CompletionWorker:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._request = None
+        self._wanted = None
+        self._done = None
+        self._generation = 0
+        self.requests = 0
+        self.stale = 0
+        self.late = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def suggest(self, inp, tabs, idx, last=()):
+        key = (inp, tabs[idx].cwd)
+        now = time.monotonic()
+        with self._cond:
+            done = self._done
+            fresh = done is not None and done[0] == key
+            if fresh and now - done[2] < COMPLETION_DEBOUNCE_MS / 1000.0:
+                return done[1]
+            if self._wanted != key:
+                self._generation += 1
+                self._request = (self._generation, key, inp, list(tabs), idx)
+                self._wanted = key
+                self.requests += 1
+                self._cond.notify_all()
+            if fresh:
+                return done[1]
+            deadline = now + COMPLETION_BUDGET_MS / 1000.0
+            while self._done is None or self._done[0] != key:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            done = self._done
+            if done is not None and done[0] == key:
+                return done[1]
+            self.late += 1
+        return [s for s in last if s.startswith(inp)]
+
+    def _run(self):
+        while not GLOBAL_SHUTDOWN.is_set():
+            with self._cond:
+                while self._request is None:
+                    self._cond.wait()
+                gen, key, inp, tabs, idx = self._request
+                self._request = None
+            try:
+                results = get_completions(inp, tabs, idx)
+            except Exception:
+                results = []
+            with self._cond:
+                if gen != self._generation:
+                    self.stale += 1
+                    continue
+                self._done = (key, results, time.monotonic())
+                self._wanted = None
+                self._cond.notify_all()
+            _wake_ui()
+
+
+
+def _completion_worker():
+    global _COMPLETER
+    with _COMPLETER_LOCK:
+        if _COMPLETER is None:
+            _COMPLETER = _CompletionWorker()
+        return _COMPLETER
+
+
+
 def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None, stdin_text=None):
+    global RENDER_MAX_FPS, RENDER_MIN_FRAME_MS, EXEC_ENGINE, STATS_FOOTER, COMPLETION_BUDGET_MS
     tab, current = _safe_get_tab(tabs, current)
     if tab is None:
         return current, False, []
@@ -1635,6 +4427,7 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
                 out_lines.append(ln)
         else:
             tab.add(text)
+    emit.flow = out_lines if capture and isinstance(out_lines, _LinePipe) else None
     if mode != 'poly':
         run = line.strip().lower()
         if run in ('cls', 'clear', 'clear-host'):
@@ -1671,7 +4464,7 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
         return current, True, []
     if lc == "tab":
         if not rest:
-            emit("Usage: tab title <t> | mode <m> | create [t] | delete <t> | export [t]")
+            emit("Usage: tab title <t> | mode <m> | scrollback <memory|disk> | create [t] | delete <t> | export [t]")
         else:
             parts = rest.split(' ', 1)
             sub = parts[0].lower()
@@ -1684,6 +4477,10 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
                 t, _ = _safe_get_tab(tabs, current)
                 if t is not None:
                     t.set_mode(arg)
+            elif sub == "scrollback" and arg:
+                t, _ = _safe_get_tab(tabs, current)
+                if t is not None:
+                    t.set_scrollback(arg.strip(), sink=emit)
             elif sub == "create":
                 title = arg if arg else "New Tab"
                 with TABS_LOCK:
@@ -1721,7 +4518,67 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
                         if t is not None:
                             export_log(t)
             else:
-                emit("Usage: tab title <t> | mode <m> | create [t] | delete <t> | export [t]")
+                emit("Usage: tab title <t> | mode <m> | scrollback <memory|disk> | create [t] | delete <t> | export [t]")
+        return current, False, []
+    if lc == "render":
+        try:
+            parts = shlex.split(rest)
+        except ValueError:
+            parts = []
+        if not parts:
+            sched = _RENDER_SCHEDULER
+            emit(f"render: max {RENDER_MAX_FPS} fps, min frame interval {RENDER_MIN_FRAME_MS} ms")
+            if sched is not None:
+                emit(f"render: {sched.frames} frames, {sched.coalesced} coalesced updates, {sched.deferred} deferred frames")
+        elif len(parts) == 2 and parts[0].lower() in ("fps", "interval"):
+            try:
+                value = int(parts[1])
+                if value < 0:
+                    raise ValueError
+            except ValueError:
+                emit("render: value must be a non-negative integer")
+                return current, False, []
+            if parts[0].lower() == "fps":
+                RENDER_MAX_FPS = value
+                emit(f"render: max fps set to {value}" + (" (unlimited)" if value == 0 else ""))
+            else:
+                RENDER_MIN_FRAME_MS = value
+                emit(f"render: min frame interval set to {value} ms")
+        else:
+            emit("Usage: render [fps <n> | interval <ms>]")
+        return current, False, []
+    if lc == "completion":
+        try:
+            parts = shlex.split(rest)
+        except ValueError:
+            parts = []
+        if not parts:
+            worker = _COMPLETER
+            emit(f"completion: budget {COMPLETION_BUDGET_MS} ms")
+            if worker is not None:
+                emit(f"completion: {worker.requests} requests, {worker.stale} stale, {worker.late} over budget")
+        elif len(parts) == 2 and parts[0].lower() == "budget":
+            try:
+                value = int(parts[1])
+                if value < 0:
+                    raise ValueError
+            except ValueError:
+                emit("completion: value must be a non-negative integer")
+                return current, False, []
+            COMPLETION_BUDGET_MS = value
+            emit(f"completion: budget set to {value} ms")
+        else:
+            emit("Usage: completion [budget <ms>]")
+        return current, False, []
+    if lc == "engine":
+        arg = rest.strip().lower()
+        if not arg:
+            emit(f"engine: {EXEC_ENGINE}")
+        elif arg in ("threads", "asyncio"):
+            EXEC_ENGINE = arg
+            emit(f"Execution engine set to {arg}")
+        else:
+            emit("Usage: engine [threads|asyncio]")
         return current, False, []
     if lc == "cd":
         if rest:
@@ -1742,7 +4599,8 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
         if rest.strip().endswith(".poly"):
             script_chars = read_poly_script(rest, base_dir=tab.cwd)
         else:
-            tab.run_exec(rest, sink=emit, synchronous=capture or (stdin_text is not None), stdin_text=stdin_text)
+            sink = out_lines if isinstance(out_lines, _LinePipe) else (emit if capture else None)
+            tab.run_exec(rest, sink=sink, synchronous=capture or (stdin_text is not None), stdin_text=stdin_text)
         return current, False, script_chars
     if lc == "makedir" and rest:
         tab.makedir(rest)
@@ -1816,7 +4674,8 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
             emit(" ".join(parts))
         else:
             if stdin_text is not None:
-                emit(stdin_text)
+                for ln in _stdin_lines(stdin_text):
+                    emit(ln)
             else:
                 emit("\n")
         return current, False, []
@@ -1930,11 +4789,103 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
                 parts = shlex.split(rest)
                 if len(parts) != 1:
                     raise ValueError
-                tab.kill(parts[0], sink=emit)
+                if parts[0].startswith("%"):
+                    tab.kill_job(int(parts[0][1:]), sink=emit)
+                else:
+                    tab.kill(parts[0], sink=emit)
             except ValueError:
-                emit("Usage: kill <processname>")
+                emit("Usage: kill <processname> | kill %<job>")
+        else:
+            emit("Usage: kill <processname> | kill %<job>")
+        return current, False, []
+    if lc == "parallel":
+        try:
+            parts = shlex.split(rest)
+        except ValueError:
+            parts = None
+        usage = "Usage: parallel [-j N] [-f file] [command ...]"
+        if parts is None:
+            emit(usage)
+            return current, False, []
+        jobs = None
+        list_file = None
+        commands = []
+        i = 0
+        try:
+            while i < len(parts):
+                opt = parts[i]
+                if opt == "-j" and i + 1 < len(parts):
+                    jobs = int(parts[i + 1])
+                    i += 2
+                elif opt.startswith("-j") and opt[2:].isdigit():
+                    jobs = int(opt[2:])
+                    i += 1
+                elif opt == "-f" and i + 1 < len(parts):
+                    list_file = parts[i + 1]
+                    i += 2
+                else:
+                    commands.extend(parts[i:])
+                    break
+            if jobs is not None and jobs < 1:
+                raise ValueError
+        except ValueError:
+            emit(usage)
+            return current, False, []
+        if list_file:
+            try:
+                path = os.path.abspath(os.path.join(tab.cwd, os.path.expanduser(list_file)))
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    commands.extend(ln for ln in f.read().splitlines() if ln.strip() and not ln.lstrip().startswith("#"))
+            except OSError as e:
+                emit(f"parallel: cannot read '{list_file}': {e}")
+                return current, False, []
+        if stdin_text is not None:
+            commands.extend(ln for ln in _stdin_lines(stdin_text) if ln.strip())
+        if not commands:
+            emit(usage)
+            return current, False, []
+        tab.parallel(commands, jobs, sink=out_lines if isinstance(out_lines, _LinePipe) else (emit if capture else None))
+        return current, False, []
+    if lc == "output":
+        parts = rest.split()
+        if not parts:
+            tab.show_output_stats(sink=emit)
+        elif len(parts) == 2 and parts[0].lower() == "policy" and parts[1].lower() in ("block", "elide", "sample"):
+            tab.output_policy = parts[1].lower()
+            emit(f"Output policy set to {tab.output_policy}")
+        elif len(parts) == 2 and parts[0].lower() == "limit" and parts[1].isdigit() and int(parts[1]) > 0:
+            tab.output_limit = int(parts[1])
+            emit(f"Output queue limit set to {tab.output_limit} lines")
+        elif len(parts) == 1 and parts[0].lower() == "reset":
+            with _OUTPUT_STATS_LOCK:
+                tab.output_stats.clear()
+            emit("Output counters reset")
+        else:
+            emit("Usage: output [policy <block|elide|sample> | limit <lines> | reset]")
+        return current, False, []
+    if lc == "stats":
+        parts = rest.lower().split()
+        if not parts:
+            tab.show_stats(sink=emit)
+        elif parts == ["reset"]:
+            with tab.usage_lock:
+                tab.usage_stats.clear()
+            emit("Command statistics reset")
+        elif len(parts) == 2 and parts[0] == "footer" and parts[1] in ("on", "off"):
+            STATS_FOOTER = parts[1] == "on"
+            emit(f"Per-command footer {parts[1]}")
+        else:
+            emit("Usage: stats [reset | footer <on|off>]")
+        return current, False, []
+    if lc == "jobs" and not rest:
+        tab.show_jobs(sink=emit)
+        return current, False, []
+    if lc == "wait":
+        arg = rest.strip().lstrip("%")
+        if arg and not arg.isdigit():
+            emit("Usage: wait [job]")
         else:
-            emit("Usage: kill <processname>")
+            tab.wait_jobs(int(arg) if arg else None, sink=emit)
         return current, False, []
     if lc == "env":
         if rest:
@@ -1965,6 +4916,7 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
                     emit(f"Invalid environment variable name: {var_name}")
                 else:
                     os.environ[var_name] = var_value
+                    _invalidate_env()
                     emit(f"Set {var_name}={var_value}")
             elif len(parts) == 1:
                 var_name = parts[0]
@@ -1972,6 +4924,7 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
                     emit(f"Invalid environment variable name: {var_name}")
                 else:
                     os.environ[var_name] = ''
+                    _invalidate_env()
                     emit(f"Set {var_name}=")
             else:
                 emit("Usage: setenv <name> [value]")
@@ -1987,6 +4940,7 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
             for var_name in parts:
                 if var_name in os.environ:
                     del os.environ[var_name]
+                    _invalidate_env()
                     emit(f"Unset {var_name}")
                 else:
                     emit(f"{var_name} is not set")
@@ -1998,7 +4952,51 @@ def handle_single_command(cmd_line, tabs, current, capture=False, out_lines=None
 
 
 
+def _pipeline_program(stage, tab):
+    line = expand_variables(stage, tab).strip()
+    cmd, _, rest = line.partition(' ')
+    lc = cmd.lower()
+    if lc in ALIASES.keys():
+        lc = ALIASES[lc].lower()
+    rest = rest.strip()
+    if lc != "run" or lc in CUSTOM_COMMANDS.keys() or not rest or rest.endswith(".poly"):
+        return None
+    return rest
+
+
+
 def handle_command(cmd_line, tabs, current, stdin_text=None, force_sync=False):
+    tab, _ = _safe_get_tab(tabs, current)
+    line = cmd_line.strip()
+    timed = line.lower() == "time" or line.lower().startswith("time ")
+    outer = _current_usage()
+    if tab is None or tab.mode != "poly" or (outer is not None and not timed):
+        return _run_command_line(cmd_line, tabs, current, stdin_text, force_sync)
+    if timed:
+        cmd_line = line[5:].strip()
+        if not cmd_line:
+            tab.add("Usage: time <command>")
+            return current, False, []
+    usage = _Usage(cmd_line)
+    _ACCOUNTING.usage = usage
+    cpu = _thread_cpu()
+    try:
+        return _run_command_line(cmd_line, tabs, current, stdin_text, force_sync)
+    finally:
+        done = _thread_cpu()
+        usage.add_cpu(done[0] - cpu[0], done[1] - cpu[1])
+        usage.finish()
+        _ACCOUNTING.usage = outer
+        if outer is None:
+            tab.record_usage(usage)
+        if timed:
+            tab.add(f"time: {usage.summary()}")
+        elif STATS_FOOTER and outer is None:
+            tab.add(f"[{usage.summary()}]")
+
+
+
+def _run_command_line(cmd_line, tabs, current, stdin_text=None, force_sync=False):
     tab, current = _safe_get_tab(tabs, current)
     if tab is None:
         return current, False, []
@@ -2007,43 +5005,81 @@ def handle_command(cmd_line, tabs, current, stdin_text=None, force_sync=False):
         if len(stages) < 2:
             tab.add("Piping requires a second operand")
             return current, False, []
-        carry = stdin_text
-        for idx, stage in enumerate(stages):
-            captured_lines = []
-            try:
-                current, should_exit, script_chars = handle_single_command(
-                    stage, tabs, current, capture=True, out_lines=captured_lines, stdin_text=carry
-                )
-            except RecursionError:
-                tab2, current = _safe_get_tab(tabs, current)
-                if tab2 is not None:
-                    tab2.add("Pipe operation too deep")
-                return current, False, []
-            if should_exit:
-                return current, True, []
+        units = []
+        for stage in stages:
+            program = _pipeline_program(stage, tab)
+            if program is not None and units and units[-1][1]:
+                units[-1][1].append(program)
+            else:
+                units.append((stage, [program] if program is not None else None))
+        stages = [programs if programs and len(programs) > 1 else stage for stage, programs in units]
+        parent = _current_job()
+        usage = _current_usage()
+        pipes = [_LinePipe(cancelled=tab.is_cancelled) for _ in stages]
+        results = [None] * len(stages)
+
+        def _stage(n):
+            _CURRENT_JOB.job = parent
+            _ACCOUNTING.usage = usage
+            cpu = _thread_cpu()
+            source = pipes[n - 1] if n else stdin_text
             try:
-                tab2, current = _safe_get_tab(tabs, current)
-                if tab2 is not None and tab2.is_cancelled():
-                    break
-            except Exception:
-                pass
-            carry = "\n".join(captured_lines)
-        if carry:
-            tab3, _ = _safe_get_tab(tabs, current)
-            if tab3 is not None:
-                for ln in carry.splitlines():
-                    tab3.add(ln)
-        return current, False, []
+                if isinstance(stages[n], list):
+                    tab.run_exec(stages[n], sink=pipes[n], synchronous=True, stdin_text=source)
+                    results[n] = (current, False, [])
+                else:
+                    results[n] = handle_single_command(
+                        stages[n], tabs, current, capture=True, out_lines=pipes[n], stdin_text=source
+                    )
+            except BaseException as e:
+                results[n] = e
+            finally:
+                _CURRENT_JOB.job = None
+                _ACCOUNTING.usage = None
+                if usage is not None:
+                    done = _thread_cpu()
+                    usage.add_cpu(done[0] - cpu[0], done[1] - cpu[1])
+                if n:
+                    pipes[n - 1].abandon()
+                pipes[n].close()
+
+        threads = [threading.Thread(target=_stage, args=(n,), daemon=True) for n in range(len(stages))]
+        for t in threads:
+            t.start()
+        for batch in pipes[-1].batches():
+            tab.add_many(batch)
+        for t in threads:
+            t.join()
+        failed = [r for r in results if isinstance(r, BaseException) and not isinstance(r, BrokenPipeError)]
+        if any(isinstance(r, RecursionError) for r in failed):
+            tab.add("Pipe operation too deep")
+            return current, False, []
+        if failed:
+            raise failed[0]
+        results = [r if isinstance(r, tuple) else None for r in results]
+        if any(r and r[1] for r in results):
+            return current, True, []
+        return (results[-1][0] if results[-1] else current), False, []
     return handle_single_command(cmd_line, tabs, current, capture=force_sync, stdin_text=stdin_text)
 
 
 
 def run_cli(stdscr):
+    global _UI_WAKER, _RENDER_SCHEDULER
     curses.curs_set(1)
     curses.noecho()
     curses.cbreak()
     stdscr.keypad(True)
     stdscr.nodelay(True)
+    _UI_WAKER = _UiWaker()
+    _RENDER_SCHEDULER = scheduler = _RenderScheduler()
+    _PATH_INDEX.refresh()
+    stdin_fd = _stdin_fd()
+    if hasattr(signal, "SIGWINCH") and threading.current_thread() is threading.main_thread():
+        try:
+            signal.signal(signal.SIGWINCH, _on_sigwinch)
+        except (OSError, ValueError):
+            pass
     curses.mousemask(curses.ALL_MOUSE_EVENTS)
     if curses.has_colors():
         curses.start_color()
@@ -2068,10 +5104,9 @@ def run_cli(stdscr):
     script_chars = read_polyrc()
     script_index = 0
     reading_script = True
-    active_worker = None
-    active_worker_tab = None
     exit_requested = False
     ui_actions = queue.Queue()
+    renderer = _Renderer(stdscr)
     while True:
         try:
             while True:
@@ -2087,6 +5122,7 @@ def run_cli(stdscr):
         if cur_tab is not None and cur_tab.pending_last_picker:
             selected_cmd = cur_tab.show_last_commands(stdscr)
             cur_tab.pending_last_picker = False
+            renderer.invalidate()
             if selected_cmd:
                 cur_tab.add(f"> {selected_cmd}")
                 try:
@@ -2102,9 +5138,9 @@ def run_cli(stdscr):
             continue
         if exit_requested:
             return
-        h, w = stdscr.getmaxyx()
+        _apply_resize()
+        h, w = renderer.begin()
         width = w - (VERTICAL_COL + 1)
-        stdscr.erase()
         with TABS_LOCK:
             tabs_snapshot = list(tabs)
             if tabs_snapshot:
@@ -2114,14 +5150,23 @@ def run_cli(stdscr):
                 cur_idx = 0
                 cur_tab_render = None
         if cur_tab_render is None:
-            time.sleep(0.05)
+            _UI_WAKER.wait(None, INPUT_POLL_MS / 1000.0)
             continue
-        draw_layout(stdscr, cur_tab_render)
-        draw_sidebar(stdscr, tabs_snapshot, cur_idx)
-        draw_messages(stdscr, cur_tab_render)
+        colors_key = (id(cur_tab_render), cur_tab_render._next_color_pair)
+        if renderer.changed("frame", colors_key):
+            draw_frame(stdscr, cur_tab_render)
+        now = datetime.datetime.now().strftime("%H:%M:%S")
+        if renderer.changed("header", (now, colors_key)):
+            draw_header(stdscr, cur_tab_render, now)
+        if renderer.changed("sidebar", (cur_idx, tuple((t.name, t._next_color_pair) for t in tabs_snapshot))):
+            draw_sidebar(stdscr, tabs_snapshot, cur_idx)
+        messages_key = (colors_key, cur_tab_render.version, cur_tab_render.scroll,
+                        cur_tab_render.wrapped_row_count(max(width, 0)))
+        if renderer.changed("messages", messages_key):
+            draw_messages(stdscr, cur_tab_render, renderer.rows)
         mode = cur_tab_render.mode
         if mode == 'poly':
-            new_sugs = get_completions(inp, tabs_snapshot, cur_idx)
+            new_sugs = _completion_worker().suggest(inp, tabs_snapshot, cur_idx, suggestions)
         else:
             new_sugs = []
         if new_sugs != suggestions:
@@ -2179,41 +5224,57 @@ def run_cli(stdscr):
         allowed_cols = 0
         if w > 0:
             allowed_cols = max(0, min(avail_cols, max(0, w - x0 - 1)))
+        prompt_vis = ""
         prompt_drawn_cols = 0
         if allowed_cols > 0 and 0 <= x0 < w and 0 <= (h - 1) < h:
             prompt_vis, _, _, prompt_drawn_cols = _slice_by_display_cols(rendered, 0, allowed_cols)
-            if prompt_vis:
-                try:
-                    stdscr.addnstr(h - 1, x0, prompt_vis, len(prompt_vis), normal_attr)
-                except curses.error:
-                    pass
+        ghost_vis = ""
         can_draw_ghost = (not right_elided)
         if can_draw_ghost and ghost and 0 <= x0 < w and 0 <= (h - 1) < h and allowed_cols > 0:
             rem_cols = max(0, min(allowed_cols - prompt_drawn_cols, max(0, w - (x0 + prompt_drawn_cols) - 1)))
             if rem_cols > 0 and (x0 + prompt_drawn_cols) < w:
                 ghost_vis, _, _, _ = _slice_by_display_cols(ghost, 0, rem_cols)
-                if ghost_vis:
-                    try:
-                        stdscr.addnstr(h - 1, x0 + prompt_drawn_cols, ghost_vis, len(ghost_vis), ghost_attr)
-                    except curses.error:
-                        pass
+        if renderer.changed("prompt", (prompt_vis, ghost_vis)) and 0 <= x0 < w:
+            try:
+                stdscr.move(h - 1, x0)
+                stdscr.clrtoeol()
+            except curses.error:
+                pass
+            if prompt_vis:
+                try:
+                    stdscr.addnstr(h - 1, x0, prompt_vis, len(prompt_vis), normal_attr)
+                except curses.error:
+                    pass
+            if ghost_vis:
+                try:
+                    stdscr.addnstr(h - 1, x0 + prompt_drawn_cols, ghost_vis, len(ghost_vis), ghost_attr)
+                except curses.error:
+                    pass
         cursor_in_slice_cols = max(caret_cols - input_view_col_start, 0)
         cursor_x = VERTICAL_COL + 1 + prefix_vis_cols + (3 if left_elided else 0) + cursor_in_slice_cols
         if w > 1 and cursor_x >= w - 1:
             cursor_x = w - 2
         elif cursor_x >= w:
             cursor_x = w - 1
-        if 0 <= h - 1 < h and 0 <= cursor_x < w:
-            stdscr.move(h - 1, max(cursor_x, 0))
-        stdscr.refresh()
+        renderer.changed("cursor", cursor_x)
+        scheduler.frame(_UI_WAKER.take_signals(), renderer.dirty)
+        if renderer.dirty:
+            if 0 <= h - 1 < h and 0 <= cursor_x < w:
+                stdscr.move(h - 1, max(cursor_x, 0))
+            stdscr.refresh()
         try:
             if script_index >= len(script_chars):
                 reading_script = False
                 ch = stdscr.get_wch()
+            elif cur_tab_render.foreground_job() is not None:
+                ch = stdscr.get_wch()
+                if ch in ("\n", "\r") or (isinstance(ch, str) and ch.isprintable()):
+                    continue
             else:
                 ch = script_chars[script_index]
         except curses.error:
-            time.sleep(0.05)
+            if not _UI_WAKER.wait(stdin_fd, max(1.0 - (time.time() % 1.0), 0.001)):
+                scheduler.throttle(_UI_WAKER, stdin_fd)
             continue
         if ch == curses.KEY_MOUSE:
             try:
@@ -2221,7 +5282,7 @@ def run_cli(stdscr):
             except Exception:
                 continue
             tab = cur_tab_render
-            max_scroll = max(len(tab.get_wrapped_lines(width)) - (h - 4), 0)
+            max_scroll = max(tab.wrapped_row_count(width) - (h - 4), 0)
             if bstate & curses.BUTTON4_PRESSED:
                 tab.scroll = min(tab.scroll + 1, max_scroll)
             elif bstate & curses.BUTTON5_PRESSED:
@@ -2279,21 +5340,19 @@ def run_cli(stdscr):
             continue
         if ch == "\x1b":
             try:
-                cur_tab_render.request_cancel()
+                cur_tab_render.cancel_foreground()
             except Exception:
                 pass
             continue
         if ch == curses.KEY_PPAGE:
             tab = cur_tab_render
-            max_scroll = max(len(tab.get_wrapped_lines(width)) - (h - 4), 0)
+            max_scroll = max(tab.wrapped_row_count(width) - (h - 4), 0)
             tab.scroll = min(tab.scroll + (h - 4), max_scroll)
             continue
         if ch == curses.KEY_NPAGE:
             tab = cur_tab_render
             tab.scroll = max(tab.scroll - (h - 4), 0)
             continue
-        if ch == curses.KEY_RESIZE:
-            continue
         if ch == curses.KEY_DOWN and suggestions:
             sugg_idx = (sugg_idx + 1) % len(suggestions)
             continue
@@ -2345,14 +5404,6 @@ def run_cli(stdscr):
                 tdel.request_cancel()
             except Exception:
                 pass
-            try:
-                if active_worker is not None and active_worker.is_alive() and (active_worker_tab is tdel):
-                    try:
-                        active_worker.join(timeout=0.3)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
             try:
                 tdel.stop()
             except Exception:
@@ -2367,13 +5418,6 @@ def run_cli(stdscr):
                 if not tabs:
                     return
                 current = min(current, len(tabs) - 1)
-            try:
-                if active_worker_tab is not None and (active_worker_tab is tdel):
-                    active_worker_tab = None
-                    if active_worker is not None and not active_worker.is_alive():
-                        active_worker = None
-            except Exception:
-                pass
             inp = ""
             cursor_pos = 0
             continue
@@ -2389,8 +5433,15 @@ def run_cli(stdscr):
                 cur_tab_render.history.append(line)
             if not reading_script:
                 cur_tab_render.add(f"> {line}")
-            if active_worker is not None and active_worker.is_alive():
-                cur_tab_render.add("Busy: command is still running. Press Esc to cancel.")
+            background = False
+            stripped_line = line.rstrip()
+            if cur_tab_render.mode == 'poly' and stripped_line.endswith("&") and not stripped_line.endswith("&&"):
+                background = True
+                line = stripped_line[:-1].rstrip()
+            if not background and cur_tab_render.foreground_job() is not None:
+                cur_tab_render.add("Busy: command is still running. Press Esc to cancel, or end a command with & to run it in the background.")
+            elif not line.strip():
+                continue
             else:
                 def _run_line_on_bg(line_to_run, start_tab_idx):
                     nonlocal script_chars, script_index, reading_script, exit_requested
@@ -2434,19 +5485,17 @@ def run_cli(stdscr):
                                 t2.clear_cancel()
                         except Exception:
                             pass
-                import threading as _threading
+                        _wake_ui()
                 with TABS_LOCK:
                     start_tab_idx_local = current if 0 <= current < len(tabs) else 0
                     start_tab_ref = tabs[start_tab_idx_local] if tabs else None
                 if start_tab_ref is None:
                     continue
-                active_worker = _threading.Thread(target=_run_line_on_bg, args=(line, start_tab_idx_local), daemon=True)
-                active_worker.start()
-                try:
-                    start_tab_ref.workers.append(active_worker)
-                except Exception:
-                    pass
-                active_worker_tab = start_tab_ref
+                job = start_tab_ref.start_job(
+                    line, functools.partial(_run_line_on_bg, line, start_tab_idx_local), background=background
+                )
+                if background and job is not None:
+                    start_tab_ref.add(f"[{job.id}] {line}")
                 continue
         if ch in (curses.KEY_BACKSPACE, "\b", "\x7f"):
             if cursor_pos > 0:
@@ -2558,6 +5607,7 @@ def main():
             GLOBAL_SHUTDOWN.set()
         except Exception:
             pass
+        _close_ui_waker()
 
 
 